@@ -1,13 +1,24 @@
-import os
-import webbrowser
+import base64
+import hashlib
 import http.server
-import urllib.parse
+import json
+import os
 import secrets
-import hashlib
-import base64
+import threading
+import time
+import urllib.parse
+import webbrowser
+from pathlib import Path
+
 import requests
+from cryptography.fernet import Fernet, InvalidToken
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are coordinated
+    fcntl = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,39 +30,16 @@ SCOPE = os.getenv("SCOPE")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 API_ENDPOINT = os.getenv("API_ENDPOINT")
 
+# Where tokens are kept between runs, encrypted
+TOKEN_CACHE = Path(os.getenv("TOKEN_CACHE", "~/.cache/dhis2-oauth-cli/tokens.bin")).expanduser()
+# Refresh this many seconds before the access token expires
+REFRESH_MARGIN = int(os.getenv("REFRESH_MARGIN", "60"))
+
 # Construct full endpoints
 AUTH_URL = f"{SERVER_BASE_URL}/oauth2/authorize"
 TOKEN_URL = f"{SERVER_BASE_URL}/oauth2/token"
 FULL_API_URL = f"{SERVER_BASE_URL}{API_ENDPOINT}"
 
-# Generate PKCE values
-code_verifier = secrets.token_urlsafe(96)
-code_challenge = (
-    base64.urlsafe_b64encode(hashlib.sha256(code_verifier.encode("ascii")).digest())
-    .decode("ascii")
-    .rstrip("=")
-)
-
-# Generate state for security
-state = secrets.token_urlsafe(16)
-
-# Build authorization URL
-auth_params = {
-    "client_id": CLIENT_ID,
-    "response_type": "code",
-    "redirect_uri": REDIRECT_URI,
-    "scope": SCOPE,
-    "state": state,
-    "code_challenge": code_challenge,
-    "code_challenge_method": "S256",
-}
-auth_url = f"{AUTH_URL}?{urllib.parse.urlencode(auth_params)}"
-
-print("Unencoded auth params:", auth_params)
-print("Full encoded auth URL:", auth_url)
-print("Opening browser for authentication...")
-#webbrowser.open(auth_url)
-
 
 # Local server to capture redirect
 class RedirectHandler(http.server.SimpleHTTPRequestHandler):
@@ -67,52 +55,228 @@ class RedirectHandler(http.server.SimpleHTTPRequestHandler):
         print("Auth code received. Closing server...")
 
 
-# Start local server
-server_address = (
-    urllib.parse.urlparse(REDIRECT_URI).hostname,
-    urllib.parse.urlparse(REDIRECT_URI).port,
-)
-httpd = http.server.HTTPServer(server_address, RedirectHandler)
-httpd.auth_code = None
-httpd.received_state = None
-print(f"Starting local server at {REDIRECT_URI} to capture redirect...")
-httpd.handle_request()  # Handle one request (the redirect)
-
-# Verify state
-if httpd.received_state != state:
-    raise ValueError("State mismatch! Possible CSRF attack.")
-
-auth_code = httpd.auth_code
-if not auth_code:
-    raise ValueError("No authorization code received.")
-
-# Exchange code for tokens
-token_data = {
-    "grant_type": "authorization_code",
-    "code": auth_code,
-    "redirect_uri": REDIRECT_URI,
-    "client_id": CLIENT_ID,
-    "client_secret": CLIENT_SECRET,
-    "code_verifier": code_verifier,
-}
-token_response = requests.post(TOKEN_URL, data=token_data)
-token_response.raise_for_status()
-tokens = token_response.json()
-
-access_token = tokens.get("access_token")
-refresh_token = tokens.get("refresh_token")
-
-print("\nAccess Token:", access_token)
-print("Refresh Token:", refresh_token)
-
-# Make a sample API request
-headers = {"Authorization": f"Bearer {access_token}"}
-api_response = requests.get(FULL_API_URL, headers=headers)
-print("\nAPI Response Status:", api_response.status_code)
-print("API Response Headers:", api_response.headers)
-try:
-    print("API Response Body:", api_response.json())
-except requests.exceptions.JSONDecodeError:
-    print("API Response Body (non-JSON):", api_response.text)
-if not api_response.ok:
-    print("Warning: API request failed, but continuing for demo purposes.")
+def browser_login():
+    """Run the authorization code + PKCE flow in the browser and return the token response."""
+    # Generate PKCE values
+    code_verifier = secrets.token_urlsafe(96)
+    code_challenge = (
+        base64.urlsafe_b64encode(hashlib.sha256(code_verifier.encode("ascii")).digest()).decode("ascii").rstrip("=")
+    )
+
+    # Generate state for security
+    state = secrets.token_urlsafe(16)
+
+    # Build authorization URL
+    auth_params = {
+        "client_id": CLIENT_ID,
+        "response_type": "code",
+        "redirect_uri": REDIRECT_URI,
+        "scope": SCOPE,
+        "state": state,
+        "code_challenge": code_challenge,
+        "code_challenge_method": "S256",
+    }
+    auth_url = f"{AUTH_URL}?{urllib.parse.urlencode(auth_params)}"
+
+    print("Unencoded auth params:", auth_params)
+    print("Full encoded auth URL:", auth_url)
+    print("Opening browser for authentication...")
+    webbrowser.open(auth_url)
+
+    # Start local server
+    server_address = (
+        urllib.parse.urlparse(REDIRECT_URI).hostname,
+        urllib.parse.urlparse(REDIRECT_URI).port,
+    )
+    httpd = http.server.HTTPServer(server_address, RedirectHandler)
+    httpd.auth_code = None
+    httpd.received_state = None
+    print(f"Starting local server at {REDIRECT_URI} to capture redirect...")
+    httpd.handle_request()  # Handle one request (the redirect)
+    httpd.server_close()
+
+    # Verify state
+    if httpd.received_state != state:
+        raise ValueError("State mismatch! Possible CSRF attack.")
+
+    auth_code = httpd.auth_code
+    if not auth_code:
+        raise ValueError("No authorization code received.")
+
+    # Exchange code for tokens
+    token_data = {
+        "grant_type": "authorization_code",
+        "code": auth_code,
+        "redirect_uri": REDIRECT_URI,
+        "client_id": CLIENT_ID,
+        "client_secret": CLIENT_SECRET,
+        "code_verifier": code_verifier,
+    }
+    token_response = requests.post(TOKEN_URL, data=token_data)
+    token_response.raise_for_status()
+    return token_response.json()
+
+
+class TokenCache:
+    """
+    Token file encrypted with Fernet (AES-128-CBC + HMAC-SHA256).
+
+    The key comes from `TOKEN_CACHE_KEY` if set, otherwise it is derived with scrypt
+    from the client secret and a random salt stored next to the cache, so the file
+    is useless without the `.env` it was created with. With neither there is no
+    secret to derive a key from, so nothing is cached and every run logs in again.
+    """
+
+    def __init__(self, path, secret):
+        self.path = path
+        self.salt_path = path.with_suffix(".salt")
+        self.secret = secret
+        self.key = os.getenv("TOKEN_CACHE_KEY")
+        # A key from an empty secret and the salt next to the file would open it for anyone who can read it
+        self.enabled = bool(self.key or secret)
+        if not self.enabled:
+            print("No TOKEN_CACHE_KEY or CLIENT_SECRET set: tokens are not cached. Set TOKEN_CACHE_KEY to cache them.")
+        self._fernet = None
+
+    def _cipher(self):
+        if self._fernet is None:
+            key = self.key
+            if not key:
+                if not self.salt_path.exists():
+                    self._write(self.salt_path, secrets.token_bytes(16))
+                salt = self.salt_path.read_bytes()
+                key = base64.urlsafe_b64encode(
+                    hashlib.scrypt(self.secret.encode(), salt=salt, n=2**14, r=8, p=1, dklen=32)
+                )
+            self._fernet = Fernet(key)
+        return self._fernet
+
+    def load(self):
+        if not self.enabled:
+            return None
+        try:
+            return json.loads(self._cipher().decrypt(self.path.read_bytes()))
+        except FileNotFoundError:
+            return None
+        except (InvalidToken, ValueError):
+            print("Token cache could not be decrypted (key or secret changed?), ignoring it.")
+            return None
+
+    def save(self, tokens):
+        if not self.enabled:
+            return
+        self._write(self.path, self._cipher().encrypt(json.dumps(tokens).encode()))
+
+    @staticmethod
+    def _write(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        # Owner-only from the start, then swapped in atomically so readers never see half a file
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class TokenManager:
+    """
+    Hands out a valid access token, going back to the browser only when it has to.
+
+    Tokens are kept in an encrypted `TokenCache` between runs. An access token
+    within `REFRESH_MARGIN` seconds of expiring is refreshed with the refresh token
+    before it is handed out. Refreshes are single-flight: concurrent callers wait
+    for the one refresh in progress instead of each starting their own, across
+    threads and, where file locks exist, across processes sharing the cache.
+    """
+
+    def __init__(self, cache, margin=REFRESH_MARGIN):
+        self.cache = cache
+        self.margin = margin
+        self.tokens = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, tokens):
+        return tokens is not None and tokens.get("expires_at", 0) - self.margin > time.time()
+
+    def access_token(self, force_refresh=False):
+        tokens = self.tokens
+        if not force_refresh and self._fresh(tokens):
+            return tokens["access_token"]
+
+        with self._lock, self._file_lock():
+            # Another thread or process may have renewed the tokens while we waited for the lock
+            latest = self.cache.load() or tokens
+            replaced = latest is not None and tokens is not None and latest["access_token"] != tokens["access_token"]
+            if self._fresh(latest) and (not force_refresh or replaced):
+                self.tokens = latest
+                return latest["access_token"]
+
+            self.tokens = self._renew(latest)
+            self.cache.save(self.tokens)
+            return self.tokens["access_token"]
+
+    def _renew(self, tokens):
+        if tokens and tokens.get("refresh_token"):
+            response = requests.post(
+                TOKEN_URL,
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": tokens["refresh_token"],
+                    "client_id": CLIENT_ID,
+                    "client_secret": CLIENT_SECRET,
+                },
+            )
+            if response.ok:
+                print("Access token refreshed.")
+                # The server may keep the old refresh token instead of sending a new one
+                return self._stamp({"refresh_token": tokens["refresh_token"], **response.json()})
+            print(f"Refresh failed ({response.status_code}), falling back to browser login.")
+
+        return self._stamp(browser_login())
+
+    @staticmethod
+    def _stamp(tokens):
+        tokens["expires_at"] = time.time() + int(tokens.get("expires_in", 300))
+        return tokens
+
+    def _file_lock(self):
+        return _FileLock(self.cache.path.with_suffix(".lock"))
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "w")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        # Closing the file releases the lock
+        self.file.close()
+
+
+def api_get(manager, url):
+    """GET `url` with the current access token, refreshing once if the server rejects it."""
+    response = requests.get(url, headers={"Authorization": f"Bearer {manager.access_token()}"})
+    if response.status_code == 401:
+        response = requests.get(url, headers={"Authorization": f"Bearer {manager.access_token(force_refresh=True)}"})
+    return response
+
+
+if __name__ == "__main__":
+    manager = TokenManager(TokenCache(TOKEN_CACHE, CLIENT_SECRET or ""))
+
+    # Make a sample API request
+    api_response = api_get(manager, FULL_API_URL)
+    print("\nAPI Response Status:", api_response.status_code)
+    print("API Response Headers:", api_response.headers)
+    try:
+        print("API Response Body:", api_response.json())
+    except requests.exceptions.JSONDecodeError:
+        print("API Response Body (non-JSON):", api_response.text)
+    if not api_response.ok:
+        print("Warning: API request failed, but continuing for demo purposes.")
@@ -1,36 +1,941 @@
+import asyncio
+import csv
+import functools
+import json
 import os
-from typing import List, Optional
+import random
+import re
+import sqlite3
+import sys
+import time
+from contextlib import AsyncExitStack
+from enum import Enum
+from pathlib import Path
+from typing import Annotated, Any, AsyncIterator, Awaitable, Callable, Iterator, List, NamedTuple, Optional, Type
 
 import httpx
 import typer
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, WrapValidator, create_model
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
 
 load_dotenv()
 
 app = typer.Typer()
 
 
+class IdOnly(BaseModel):
+    id: str
+
+
 class DataElement(BaseModel):
     id: str
     name: str = Field(alias="displayName")
+    last_updated: Optional[str] = Field(None, alias="lastUpdated")
 
 
-class DataElementsResponse(BaseModel):
-    dataElements: List[DataElement]
+class Pager(BaseModel):
+    page: int = 1
+    pageCount: int = 1
+    total: int = 0
+    pageSize: int = 50
 
 
-@app.command()
-def fetch_data(
-    url: Optional[str] = typer.Argument(None, help="Base URL of the API"),
-    username: Optional[str] = typer.Option(None, help="API username"),
-    password: Optional[str] = typer.Option(None, help="API password"),
-):
+class DataElementIn(DataElement):
+    groups: List[IdOnly] = Field(default_factory=list, alias="dataElementGroups")
+
+
+@functools.cache
+def page_model(resource: str, item_type: Any) -> Type[BaseModel]:
+    """Model for one page of `resource`: the pager and a list of `item_type`, e.g. `dataElements: List[DataElement]`."""
+    return create_model(f"{resource}Page", pager=(Optional[Pager], None), **{resource: (List[item_type], ...)})
+
+
+# ---- Other Metadata ----
+
+
+class MetadataObject(BaseModel):
+    id: str
+    name: str = Field(alias="displayName")
+    last_updated: Optional[str] = Field(None, alias="lastUpdated")
+
+
+class DataElementGroup(MetadataObject):
+    data_elements: List[IdOnly] = Field(default_factory=list, alias="dataElements")
+
+
+class OrganisationUnit(MetadataObject):
+    level: Optional[int] = None
+    path: Optional[str] = None
+    parent: Optional[IdOnly] = None
+
+
+class CategoryCombo(MetadataObject):
+    categories: List[IdOnly] = Field(default_factory=list)
+
+
+class Category(MetadataObject):
+    category_options: List[IdOnly] = Field(default_factory=list, alias="categoryOptions")
+
+
+class Indicator(MetadataObject):
+    numerator: Optional[str] = None
+    denominator: Optional[str] = None
+
+
+class ResourceSpec(NamedTuple):
+    model: Type[BaseModel]
+    fields: str
+
+
+# What `sync` fetches: the model of each resource and the fields it needs
+SYNC_RESOURCES = {
+    "dataElements": ResourceSpec(DataElementIn, "id,displayName,lastUpdated,dataElementGroups[id]"),
+    "dataElementGroups": ResourceSpec(DataElementGroup, "id,displayName,lastUpdated,dataElements[id]"),
+    "organisationUnits": ResourceSpec(OrganisationUnit, "id,displayName,lastUpdated,level,path,parent[id]"),
+    "categoryCombos": ResourceSpec(CategoryCombo, "id,displayName,lastUpdated,categories[id]"),
+    "categories": ResourceSpec(Category, "id,displayName,lastUpdated,categoryOptions[id]"),
+    "indicators": ResourceSpec(Indicator, "id,displayName,lastUpdated,numerator,denominator"),
+}
+
+
+# ---- Streaming JSON ----
+
+
+# Possessive quantifiers throughout, so an element cut off at the end of the buffer fails to match in linear time
+JSON_STRING = rb'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+
+
+def json_container_pattern(depth: int) -> bytes:
+    """Regex for the contents of a JSON object or array with up to `depth` more levels of nesting inside."""
+    pattern = rb'(?:[^{}\[\]"]++|' + JSON_STRING + rb")*+"
+    for _ in range(depth):
+        pattern = rb'(?:[^{}\[\]"]++|' + JSON_STRING + rb"|\{" + pattern + rb"\}|\[" + pattern + rb"\])*+"
+    return pattern
+
+
+class JSONArraySplitter:
     """
-    Fetch and print dataElements (id, displayName) from the API.
-    Uses environment variables if available, otherwise prompts for missing values.
+    Cuts the array under one top-level key out of a JSON object as it streams in.
+
+    Feed it the document in chunks of any size; `feed` yields the raw bytes of each
+    array element as soon as the element is complete. Only the element being read
+    is buffered, and nothing is decoded, so each element can go straight into
+    `model_validate_json` and memory stays bounded by the largest element.
+    """
+
+    # A whole string (with escapes), an unterminated string, or a structural character
+    _TOKEN = re.compile(JSON_STRING + rb'|"|[{}\[\],]')
+    # Fast path: a whole element nested up to four deep, plus the `,` or `]` after it, in one match
+    _ELEMENT = re.compile(rb"\s*(\{%s\}|\[%s\])\s*([,\]])" % ((json_container_pattern(3),) * 2))
+
+    def __init__(self, key: str) -> None:
+        self.key = json.dumps(key).encode()
+        self.done = False
+        self._buf = bytearray()
+        self._pos = 0
+        self._depth = 0
+        # The last string seen directly inside the top-level object, i.e. the current key
+        self._last_key = b""
+        self._in_array = False
+        self._item_start = 0
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        if self.done:
+            return
+        buf = self._buf
+        buf += data
+        pos, depth, in_array, item_start = self._pos, self._depth, self._in_array, self._item_start
+
+        while not self.done:
+            if in_array and pos == item_start:
+                element = self._ELEMENT.match(buf, pos)
+                if element is not None:
+                    yield element.group(1)
+                    pos = item_start = element.end()
+                    self.done = element.group(2) == b"]"
+                    continue
+
+            match = self._TOKEN.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            start, pos = match.span()
+            token = buf[start]
+            if token == 0x22:  # "
+                if pos - start == 1:
+                    # The string goes on in the next chunk; scan it again from its start then
+                    pos = start
+                    break
+                if depth == 1:
+                    self._last_key = match.group()
+            elif token == 0x7B or token == 0x5B:  # { [
+                if token == 0x5B and depth == 1 and not in_array and self._last_key == self.key:
+                    in_array, item_start = True, pos
+                depth += 1
+            elif token == 0x7D or token == 0x5D:  # } ]
+                depth -= 1
+                if in_array and depth == 1:
+                    item = bytes(buf[item_start:start]).strip()
+                    if item:
+                        yield item
+                    self.done = True
+            elif in_array and depth == 2:  # , between elements
+                yield bytes(buf[item_start:start]).strip()
+                item_start = pos
+
+        if self.done:
+            self._buf = bytearray()
+            return
+        # Matches hold on to the buffer, which can't be resized while they do
+        match = element = None
+        # Drop what has been read, except the element being assembled
+        keep = item_start if in_array else pos
+        del buf[:keep]
+        self._pos, self._depth, self._in_array, self._item_start = pos - keep, depth, in_array, item_start - keep
+
+
+# ---- Bulk Validation ----
+
+
+class RecordError(NamedTuple):
+    # Position among all records the validator has seen, in the order it saw them
+    index: int
+    id: Optional[str]
+    errors: list[dict]
+
+    def summary(self) -> str:
+        return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'record'}: {e['msg']}" for e in self.errors)
+
+
+def _keep_invalid_out(value, handler, info):
+    """Validate one record; an invalid one becomes None and its errors go to the validation context."""
+    try:
+        return handler(value)
+    except ValidationError as e:
+        uid = value.get("id") if isinstance(value, dict) else None
+        info.context.append((uid if isinstance(uid, str) else None, e.errors(include_url=False)))
+        return None
+
+
+@functools.cache
+def lenient(item_model: Type[BaseModel]) -> Any:
+    return Annotated[item_model, WrapValidator(_keep_invalid_out)]
+
+
+@functools.cache
+def list_adapter(item_type: Any) -> TypeAdapter:
+    # Building a TypeAdapter compiles a validator, so each is built once and reused
+    return TypeAdapter(List[item_type])
+
+
+class BulkValidator:
+    """
+    Validates many `item_model` records straight from JSON bytes, keeping the valid ones.
+
+    Each chunk (a JSON array, a list of raw records or a page) is validated in one
+    pass by a plain list validator, without building Python dicts first. Only a
+    chunk that fails is validated again by a lenient one, which drops invalid records
+    and notes why, so a few bad records cost a second pass over their own chunk
+    instead of failing the whole import. The first `max_errors` are kept in `errors`.
+    """
+
+    def __init__(self, item_model: Type[BaseModel], max_errors: int = 100) -> None:
+        self.item_model = item_model
+        self.max_errors = max_errors
+        self.errors: list[RecordError] = []
+        self.records = 0
+        self.invalid = 0
+        self.seconds = 0.0
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+    def validate(self, data: str | bytes) -> list:
+        """Validate a JSON array of records and return the valid ones."""
+        return self._run(
+            list_adapter(self.item_model).validate_json, list_adapter(lenient(self.item_model)).validate_json, data
+        )
+
+    def validate_chunk(self, records: list[bytes]) -> list:
+        """Validate records given as the JSON bytes of each, e.g. from `JSONArraySplitter`."""
+        return self.validate(b"[" + b",".join(records) + b"]")
+
+    def validate_page(self, resource: str, data: bytes) -> tuple[Optional[Pager], list]:
+        """Validate one page of `resource` and return its pager and valid records."""
+        page = self._run(
+            page_model(resource, self.item_model).model_validate_json,
+            page_model(resource, lenient(self.item_model)).model_validate_json,
+            data,
+            resource,
+        )
+        return page.pager, getattr(page, resource)
+
+    def _run(self, strict, lax, data: str | bytes, resource: Optional[str] = None):
+        """Validate `data` with `strict`, or `lax` if that fails. The records are `data` itself or its `resource`."""
+        started = time.perf_counter()
+        try:
+            result = strict(data)
+            records = getattr(result, resource) if resource else result
+        except ValidationError:
+            # Anything wrong outside the records themselves fails this pass too, and is raised
+            problems = []
+            result = lax(data, context=problems)
+            records = getattr(result, resource) if resource else result
+            invalid = [index for index, record in enumerate(records) if record is None]
+            room = max(0, self.max_errors - len(self.errors))
+            self.errors += [
+                RecordError(self.records + index, uid, errors)
+                for index, (uid, errors) in zip(invalid[:room], problems[:room])
+            ]
+            self.records += len(records)
+            self.invalid += len(invalid)
+            records[:] = [record for record in records if record is not None]
+        else:
+            self.records += len(records)
+        self.seconds += time.perf_counter() - started
+        return result
+
+
+# ---- Async API Client ----
+
+# Worth another try: rate limiting and server-side or gateway failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Longest wait before a retry, in seconds, whatever Retry-After asks for
+MAX_BACKOFF = 30.0
+
+
+class DHIS2Client:
+    """
+    Async DHIS2 API client sharing one pool of keep-alive connections.
+
+    At most `concurrency` requests are in flight at once, whatever they are for,
+    over at most `connections` connections to the server (default: one per
+    request; with HTTP/2 fewer connections can carry them all). Requests that hit a
+    transport error or one of `RETRY_STATUSES` are retried up to `retries` times
+    with jittered exponential backoff, honouring `Retry-After` up to `MAX_BACKOFF` seconds.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        auth: tuple[str, str],
+        *,
+        concurrency: int = 8,
+        connections: Optional[int] = None,
+        http2: bool = False,
+        retries: int = 5,
+        timeout: float = 60.0,
+    ) -> None:
+        self.retries = retries
+        self.semaphore = asyncio.Semaphore(concurrency)
+        connections = connections or concurrency
+        self.http = httpx.AsyncClient(
+            base_url=f"{base_url.rstrip('/')}/api",
+            auth=auth,
+            http2=http2,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self) -> "DHIS2Client":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.http.aclose()
+
+    async def get(self, path: str, params: dict) -> httpx.Response:
+        """GET `path`, retrying transient failures. Raises `httpx.HTTPStatusError` once retries run out."""
+        for attempt in range(self.retries + 1):
+            async with self.semaphore:
+                try:
+                    response = await self.http.get(path, params=params)
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        raise
+                    response = None
+
+            if response is not None and (response.status_code not in RETRY_STATUSES or attempt == self.retries):
+                response.raise_for_status()
+                return response
+            # The slot is released while backing off, so other requests keep the connections busy
+            await asyncio.sleep(self._backoff(attempt, response))
+
+    @staticmethod
+    def _backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            # A misbehaving server must not be able to stall the client for hours
+            return min(MAX_BACKOFF, float(retry_after))
+        # "Full jitter": spread retries out so they don't hit the server in lockstep
+        return random.uniform(0, min(MAX_BACKOFF, 0.5 * 2**attempt))
+
+    async def server_date(self) -> str:
+        """The server's current time, `serverDate` from `system/info`, in the same form as `lastUpdated`."""
+        return (await self.get("system/info", {})).json()["serverDate"]
+
+    async def fetch_pages(
+        self,
+        resource: str,
+        validator: BulkValidator,
+        *,
+        fields: str,
+        page_size: int = 1000,
+        on_page: Optional[Callable[[int, Pager], None]] = None,
+    ) -> AsyncIterator[list]:
+        """
+        Yield the valid objects of `resource` one page at a time, as checked by `validator`.
+
+        The first page tells how many pages there are; the rest are then fetched
+        concurrently and yielded in the order they arrive, not in page order.
+        `on_page(pages_done, pager)` is called after each page.
+        """
+        params = {"fields": fields, "pageSize": page_size, "totalPages": "true"}
+        pager, items = validator.validate_page(resource, (await self.get(resource, {**params, "page": 1})).content)
+        pager = pager or Pager(pageCount=1, pageSize=page_size)
+        if on_page:
+            on_page(1, pager)
+        yield items
+
+        async def fetch_page(page: int) -> list:
+            response = await self.get(resource, {**params, "page": page})
+            return validator.validate_page(resource, response.content)[1]
+
+        tasks = [asyncio.create_task(fetch_page(page)) for page in range(2, pager.pageCount + 1)]
+        try:
+            for done, task in enumerate(asyncio.as_completed(tasks), start=2):
+                items = await task
+                if on_page:
+                    on_page(done, pager)
+                yield items
+        finally:
+            # The consumer stopped early or a page failed: don't leave requests running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stream_items(
+        self,
+        resource: str,
+        validator: BulkValidator,
+        *,
+        fields: str,
+        batch_size: int = 1000,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        on_response: Optional[Callable[[httpx.Response], None]] = None,
+    ) -> AsyncIterator[list]:
+        """
+        Yield all valid objects of `resource` from one unpaged response, in batches of up to `batch_size`.
+
+        The array is cut out of the response as its bytes arrive and `validator`
+        checks it a batch at a time, so neither the whole body nor all objects are ever
+        in memory at once. A failed request is retried as long as nothing has been yielded.
+        `on_response` gets the response before its body is read, e.g. to look at its
+        headers; a 304 Not Modified yields nothing. Raises `ValueError` if the body has
+        no `resource` array or ends before it does, as then it may hold only some of them.
+        """
+        params = {**(params or {}), "fields": fields, "paging": "false"}
+        delay = 0.0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(delay)
+            yielded = False
+            try:
+                async with AsyncExitStack() as stack:
+                    async with self.semaphore:
+                        response = await stack.enter_async_context(
+                            self.http.stream("GET", resource, params=params, headers=headers)
+                        )
+                        if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                            delay = self._backoff(attempt, response)
+                            continue
+                        if response.is_error:
+                            await response.aread()
+                            response.raise_for_status()
+                    if on_response:
+                        on_response(response)
+                    if response.status_code == 304:
+                        return
+
+                    # The slot is only held while reading, not while a batch is handed out, so a
+                    # slow consumer doesn't hold up other requests on this client
+                    splitter = JSONArraySplitter(resource)
+                    body = response.aiter_bytes()
+                    raw = []
+                    while True:
+                        async with self.semaphore:
+                            chunk = await anext(body, None)
+                        if chunk is None:
+                            break
+                        for element in splitter.feed(chunk):
+                            raw.append(element)
+                            if len(raw) == batch_size:
+                                if batch := validator.validate_chunk(raw):
+                                    yielded = True
+                                    yield batch
+                                raw = []
+                    if not splitter.done:
+                        raise ValueError(f"Response has no complete {resource!r} array")
+                    if raw and (batch := validator.validate_chunk(raw)):
+                        yielded = True
+                        yield batch
+                    return
+            except httpx.TransportError:
+                if yielded or attempt == self.retries:
+                    raise
+                delay = self._backoff(attempt, None)
+
+
+# ---- Local Metadata Cache ----
+
+
+class SyncState(NamedTuple):
+    # Server time when the last sync that found changes started; the next asks for objects changed since then
+    watermark: Optional[str] = None
+    # ETag of the last delta query, sent as If-None-Match while the watermark stays the same
+    etag: Optional[str] = None
+    synced_at: float = 0.0
+    reconciled_at: float = 0.0
+
+
+class MetadataCache:
+    """
+    SQLite file holding fetched DHIS2 objects as JSON, keyed by resource and id.
+
+    Each resource has a `SyncState`, so later syncs only fetch what changed since
+    the last one. Deleted objects never show up in such a delta, so
+    `delete_missing` removes cached objects that are no longer on the server.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS objects (
+                resource TEXT NOT NULL,
+                id TEXT NOT NULL,
+                last_updated TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (resource, id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sync_state (
+                resource TEXT PRIMARY KEY,
+                watermark TEXT,
+                etag TEXT,
+                synced_at REAL NOT NULL,
+                reconciled_at REAL NOT NULL
+            );
+            """
+        )
+
+    def __enter__(self) -> "MetadataCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.db.close()
+
+    def state(self, resource: str) -> SyncState:
+        row = self.db.execute(
+            "SELECT watermark, etag, synced_at, reconciled_at FROM sync_state WHERE resource = ?", (resource,)
+        ).fetchone()
+        return SyncState(*row) if row else SyncState()
+
+    def save_state(self, resource: str, state: SyncState) -> None:
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)", (resource, *state))
+
+    def upsert(self, resource: str, objects: list[BaseModel]) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)",
+                [(resource, obj.id, obj.last_updated, obj.model_dump_json(by_alias=True)) for obj in objects],
+            )
+
+    async def delete_missing(self, resource: str, id_batches: AsyncIterator[list[str]]) -> int:
+        """Delete cached objects of `resource` whose id is not among `id_batches`. Returns how many."""
+        # The ids go to a temporary table as they arrive, so they never all have to be in memory.
+        # Each step is its own transaction: other resources may be syncing while the ids come in.
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS live_ids (resource TEXT, id TEXT, PRIMARY KEY (resource, id))")
+        with self.db:
+            self.db.execute("DELETE FROM live_ids WHERE resource = ?", (resource,))
+        async for ids in id_batches:
+            with self.db:
+                self.db.executemany("INSERT OR IGNORE INTO live_ids VALUES (?, ?)", [(resource, id) for id in ids])
+        with self.db:
+            deleted = self.db.execute(
+                "DELETE FROM objects WHERE resource = ? AND id NOT IN (SELECT id FROM live_ids WHERE resource = ?)",
+                (resource, resource),
+            ).rowcount
+            self.db.execute("DELETE FROM live_ids WHERE resource = ?", (resource,))
+        return deleted
+
+    def batches(self, resource: str, model: Type[BaseModel], batch_size: int = 1000) -> Iterator[list]:
+        cursor = self.db.execute("SELECT data FROM objects WHERE resource = ? ORDER BY id", (resource,))
+        validator = BulkValidator(model)
+        while rows := cursor.fetchmany(batch_size):
+            yield validator.validate("[" + ",".join(data for (data,) in rows) + "]")
+
+
+class SyncResult(NamedTuple):
+    fetched: int
+    deleted: int
+    not_modified: bool
+    # Objects skipped because they did not validate
+    invalid: int = 0
+
+
+async def sync_resource(
+    client: DHIS2Client,
+    cache: MetadataCache,
+    resource: str,
+    item_model: Type[BaseModel],
+    *,
+    fields: str,
+    reconcile_every: float = 24 * 3600,
+    batch_size: int = 1000,
+) -> SyncResult:
+    """
+    Bring the cached `resource` up to date with the server.
+
+    The first sync fetches everything, page by page in parallel. Later ones fetch only objects whose
+    `lastUpdated` is at or after the watermark, and nothing at all when the server
+    answers the repeated query with 304 Not Modified. `ge` rather than `gt`, so
+    objects saved in the same millisecond as the watermark are not missed; fetching
+    those again is harmless. Every `reconcile_every` seconds the ids on the server
+    are listed to drop objects that were deleted there.
+
+    The watermark is the server's own time read just before the fetch started, not
+    the newest `lastUpdated` seen: pages arrive out of order and over a while, so an
+    object changed meanwhile can be missing from them and still be older than that.
+    """
+    state = cache.state(resource)
+    # Anything changed from here on has a lastUpdated at or after this, so the next sync catches it
+    started_at = await client.server_date()
+    params, headers = {}, {}
+    if state.watermark:
+        params["filter"] = f"lastUpdated:ge:{state.watermark}"
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+
+    responses = []
+    validator = BulkValidator(item_model)
+    if state.watermark is None:
+        batches = client.fetch_pages(resource, validator, fields=fields, page_size=batch_size)
+    else:
+        batches = client.stream_items(
+            resource,
+            validator,
+            fields=fields,
+            batch_size=batch_size,
+            params=params,
+            headers=headers,
+            on_response=responses.append,
+        )
+
+    fetched = 0
+    async for batch in batches:
+        cache.upsert(resource, batch)
+        fetched += len(batch)
+    # When nothing came back the query, and with it the ETag, can stay the same
+    watermark = started_at if state.watermark is None or fetched or validator.invalid else state.watermark
+
+    now = time.time()
+    reconciled_at = state.reconciled_at
+    deleted = 0
+    if state.watermark is None:
+        # A full fetch has nothing to reconcile yet
+        reconciled_at = now
+    elif now - state.reconciled_at >= reconcile_every:
+        id_batches = client.stream_items(resource, BulkValidator(IdOnly), fields="id", batch_size=10_000)
+        deleted = await cache.delete_missing(resource, ([obj.id for obj in batch] async for batch in id_batches))
+        reconciled_at = now
+
+    etag, not_modified = None, False
+    if responses:
+        response = responses[-1]
+        not_modified = response.status_code == 304
+        # The ETag belongs to this exact query, which is only asked again if the watermark stays put
+        etag = state.etag if not_modified else response.headers.get("ETag") if watermark == state.watermark else None
+    cache.save_state(resource, SyncState(watermark, etag, now, reconciled_at))
+    return SyncResult(fetched, deleted, not_modified, validator.invalid)
+
+
+# ---- Output ----
+
+
+def echo_data_elements(elements: list) -> None:
+    if elements:
+        # One write per page: echoing each line flushes stdout every time
+        typer.echo("\n".join(f"{element.id}: {element.name}" for element in elements))
+
+
+def echo_validation(resource: str, validator: BulkValidator, examples: int = 5) -> None:
+    typer.echo(
+        f"🔎 {validator.records} {resource} validated ({validator.records_per_second:,.0f}/s), "
+        f"{validator.invalid} invalid",
+        err=True,
+    )
+    for error in validator.errors[:examples]:
+        typer.echo(f"   #{error.index} {error.id or '(no id)'}: {error.summary()}", err=True)
+    if validator.invalid > examples:
+        typer.echo(f"   … and {validator.invalid - examples} more", err=True)
+
+
+def show_progress(done: int, pager: Pager) -> None:
+    typer.echo(f"\rFetched {done}/{pager.pageCount} pages", err=True, nl=False)
+    if done == pager.pageCount:
+        typer.echo(err=True)
+
+
+async def fetch_data_elements(
+    client: DHIS2Client, *, fields: str, page_size: int, progress: bool, stream: bool, groups: bool = False
+) -> AsyncIterator[list]:
+    """
+    Yield valid dataElements in batches, paged and concurrent or, with `stream`, from one streamed response.
+    Invalid ones are skipped and reported on stderr at the end.
+    """
+    validator = BulkValidator(DataElementIn if groups else DataElement)
+    if not stream:
+        async for elements in client.fetch_pages(
+            "dataElements",
+            validator,
+            fields=fields,
+            page_size=page_size,
+            on_page=show_progress if progress else None,
+        ):
+            yield elements
+    else:
+        count = 0
+        async for elements in client.stream_items("dataElements", validator, fields=fields, batch_size=page_size):
+            count += len(elements)
+            if progress:
+                typer.echo(f"\rFetched {count} dataElements", err=True, nl=False)
+            yield elements
+        if progress:
+            typer.echo(err=True)
+    echo_validation("dataElements", validator)
+
+
+async def print_data_elements(client: DHIS2Client, page_size: int, progress: bool, stream: bool) -> int:
+    count = 0
+    async for elements in fetch_data_elements(
+        client, fields="id,displayName", page_size=page_size, progress=progress, stream=stream
+    ):
+        echo_data_elements(elements)
+        count += len(elements)
+    return count
+
+
+async def print_cached_data_elements(
+    client: DHIS2Client, cache_path: Path, page_size: int, reconcile_hours: float
+) -> int:
+    with MetadataCache(cache_path) as cache:
+        result = await sync_resource(
+            client,
+            cache,
+            "dataElements",
+            DataElement,
+            fields="id,displayName,lastUpdated",
+            reconcile_every=reconcile_hours * 3600,
+            batch_size=page_size,
+        )
+        status = "not modified" if result.not_modified else f"{result.fetched} fetched, {result.invalid} invalid"
+        typer.echo(f"🔄 {cache_path}: {status}, {result.deleted} deleted", err=True)
+
+        count = 0
+        for elements in cache.batches("dataElements", DataElement, page_size):
+            echo_data_elements(elements)
+            count += len(elements)
+        return count
+
+
+# ---- Export ----
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    parquet = "parquet"
+
+
+EXPORT_SUFFIXES = {
+    ".csv": ExportFormat.csv,
+    ".ndjson": ExportFormat.ndjson,
+    ".jsonl": ExportFormat.ndjson,
+    ".parquet": ExportFormat.parquet,
+}
+
+
+def column_values(elements: list, column: str) -> list:
+    if column == "groups":
+        return [[group.id for group in element.groups] for element in elements]
+    return [getattr(element, column) for element in elements]
+
+
+class CSVExporter:
+    """One row per element; `groups` holds the group ids separated by `;`."""
+
+    def __init__(self, path: Path, columns: list[str]) -> None:
+        self.columns = columns
+        self.file = open(path, "w", newline="", encoding="utf-8", buffering=1 << 20)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, elements: list) -> None:
+        columns = [column_values(elements, column) for column in self.columns]
+        if "groups" in self.columns:
+            index = self.columns.index("groups")
+            columns[index] = [";".join(ids) for ids in columns[index]]
+        self.writer.writerows(zip(*columns))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class NDJSONExporter:
+    """One JSON object per line, shaped like the model (groups as `{"id": ...}` objects)."""
+
+    def __init__(self, path: Path, columns: list[str]) -> None:
+        self.file = open(path, "w", encoding="utf-8", buffering=1 << 20)
+
+    def write(self, elements: list) -> None:
+        self.file.write("".join(f"{element.model_dump_json()}\n" for element in elements))
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetExporter:
+    """
+    Columnar file with zstd compression. Elements are collected into row groups of
+    `row_group_size`, since many small row groups make the file slow to read.
+    """
+
+    TYPES = {"groups": pa.list_(pa.string())} if pa else {}
+
+    def __init__(self, path: Path, columns: list[str], row_group_size: int = 64 * 1024) -> None:
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(column, self.TYPES.get(column, pa.string())) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        self.pending: list = []
+
+    def write(self, elements: list) -> None:
+        self.pending.extend(elements)
+        if len(self.pending) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.pending:
+            columns = {column: column_values(self.pending, column) for column in self.schema.names}
+            self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+            self.pending = []
+
+    def close(self) -> None:
+        self._flush()
+        self.writer.close()
+
+
+EXPORTERS = {ExportFormat.csv: CSVExporter, ExportFormat.ndjson: NDJSONExporter, ExportFormat.parquet: ParquetExporter}
+
+
+async def export_data_elements(
+    client: DHIS2Client,
+    output: Path,
+    format: ExportFormat,
+    *,
+    groups: bool,
+    page_size: int,
+    progress: bool,
+    stream: bool,
+) -> int:
+    columns = ["id", "name", "last_updated"] + (["groups"] if groups else [])
+    fields = "id,displayName,lastUpdated" + (",dataElementGroups[id]" if groups else "")
+
+    # Written next to the target and renamed at the end, so a failed export leaves no partial file behind
+    partial = output.with_name(output.name + ".part")
+    exporter = EXPORTERS[format](partial, columns)
+    count = 0
+    try:
+        async for elements in fetch_data_elements(
+            client, fields=fields, page_size=page_size, progress=progress, stream=stream, groups=groups
+        ):
+            exporter.write(elements)
+            count += len(elements)
+        exporter.close()
+        partial.replace(output)
+    except BaseException:
+        exporter.close()
+        partial.unlink(missing_ok=True)
+        raise
+    return count
+
+
+# ---- Sync ----
+
+
+class SyncReport(NamedTuple):
+    resource: str
+    seconds: float
+    result: Optional[SyncResult] = None
+    error: Optional[str] = None
+
+
+async def sync_all(
+    client: DHIS2Client, cache: MetadataCache, resources: list[str], *, page_size: int, reconcile_every: float
+) -> list[SyncReport]:
+    """
+    Sync `resources` into `cache` all at once. Their requests share the client's
+    concurrency budget, so the whole sync takes about as long as the slowest
+    resource. A failing resource is reported and does not stop the others.
     """
 
+    async def sync_one(resource: str) -> SyncReport:
+        spec = SYNC_RESOURCES[resource]
+        started = time.perf_counter()
+        try:
+            result = await sync_resource(
+                client,
+                cache,
+                resource,
+                spec.model,
+                fields=spec.fields,
+                reconcile_every=reconcile_every,
+                batch_size=page_size,
+            )
+        except (httpx.HTTPError, ValueError) as e:
+            detail = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else str(e)
+            return SyncReport(resource, time.perf_counter() - started, error=detail or type(e).__name__)
+        return SyncReport(resource, time.perf_counter() - started, result)
+
+    return await asyncio.gather(*(sync_one(resource) for resource in resources))
+
+
+def echo_sync_reports(reports: list[SyncReport], elapsed: float) -> None:
+    typer.echo(f"{'resource':<20} {'fetched':>9} {'invalid':>8} {'deleted':>8} {'seconds':>8}")
+    for report in reports:
+        if report.error:
+            typer.echo(f"{report.resource:<20} ❌ {report.error}")
+            continue
+        result = report.result
+        fetched = "-" if result.not_modified else result.fetched
+        typer.echo(f"{report.resource:<20} {fetched:>9} {result.invalid:>8} {result.deleted:>8} {report.seconds:>8.2f}")
+    summed = sum(report.seconds for report in reports)
+    typer.echo(f"{'total':<20} {'':>9} {'':>8} {'':>8} {elapsed:>8.2f}  (resources one after another: {summed:.2f})")
+
+
+# ---- Commands ----
+
+
+def resolve_connection(url: Optional[str], username: Optional[str], password: Optional[str]) -> tuple[str, str, str]:
+    """Fill in what was not given from env vars, prompting for missing credentials."""
     # Fallback to env vars if CLI args not given
     url = url or os.getenv("API_URL")
     username = username or os.getenv("API_USERNAME")
@@ -44,17 +949,15 @@ def fetch_data(
     if not url:
         typer.echo("❌ Missing URL. Provide via argument or set API_URL in .env", err=True)
         raise typer.Exit(1)
+    return url, username, password
 
-    api_url = f"{url.rstrip('/')}/api/dataElements"
 
+def run_and_report(main: Callable[[], Awaitable[int]]) -> None:
     try:
-        response = httpx.get(api_url, auth=(username, password))
-        response.raise_for_status()
-
-        data = DataElementsResponse.model_validate(response.json())
-
-        for element in data.dataElements:
-            typer.echo(f"{element.id}: {element.name}")
+        started = time.perf_counter()
+        count = asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        typer.echo(f"✅ {count} dataElements in {elapsed:.2f}s ({count / elapsed:,.0f}/s)", err=True)
 
     except httpx.HTTPStatusError as e:
         typer.echo(f"❌ HTTP error {e.response.status_code}: {e.response.text}", err=True)
@@ -62,5 +965,124 @@ def fetch_data(
         typer.echo(f"❌ Unexpected error: {e}", err=True)
 
 
+@app.command()
+def fetch_data(
+    url: Optional[str] = typer.Argument(None, help="Base URL of the API"),
+    username: Optional[str] = typer.Option(None, help="API username"),
+    password: Optional[str] = typer.Option(None, help="API password"),
+    page_size: int = typer.Option(1000, min=1, help="Objects per page (per batch with --stream)"),
+    stream: bool = typer.Option(
+        False, help="Fetch everything in one response, parsed as it arrives in constant memory"
+    ),
+    concurrency: int = typer.Option(8, min=1, help="Maximum number of requests in flight"),
+    http2: bool = typer.Option(False, help="Use HTTP/2 (needs `pip install httpx[http2]`)"),
+    progress: Optional[bool] = typer.Option(None, help="Show progress on stderr [default: when it is a terminal]"),
+    cache: Optional[Path] = typer.Option(
+        None, help="SQLite file to keep dataElements in between runs; later runs only fetch changes"
+    ),
+    reconcile_hours: float = typer.Option(24, help="With --cache: how often to check for deleted dataElements"),
+):
+    """
+    Fetch and print dataElements (id, displayName) from the API.
+    Uses environment variables if available, otherwise prompts for missing values.
+    """
+
+    url, username, password = resolve_connection(url, username, password)
+    cache = cache or (Path(os.environ["API_CACHE"]) if os.getenv("API_CACHE") else None)
+    if progress is None:
+        progress = sys.stderr.isatty()
+
+    async def run() -> int:
+        async with DHIS2Client(url, (username, password), concurrency=concurrency, http2=http2) as client:
+            if cache:
+                return await print_cached_data_elements(client, cache, page_size, reconcile_hours)
+            return await print_data_elements(client, page_size, progress, stream)
+
+    run_and_report(run)
+
+
+@app.command()
+def export(
+    output: Path = typer.Argument(..., help="File to write (.csv, .ndjson, .jsonl or .parquet)"),
+    url: Optional[str] = typer.Argument(None, help="Base URL of the API"),
+    username: Optional[str] = typer.Option(None, help="API username"),
+    password: Optional[str] = typer.Option(None, help="API password"),
+    format: Optional[ExportFormat] = typer.Option(None, help="Output format [default: from the file extension]"),
+    groups: bool = typer.Option(False, help="Include the ids of each element's dataElementGroups"),
+    page_size: int = typer.Option(1000, min=1, help="Objects per page (per batch with --stream)"),
+    stream: bool = typer.Option(
+        False, help="Fetch everything in one response, parsed as it arrives in constant memory"
+    ),
+    concurrency: int = typer.Option(8, min=1, help="Maximum number of requests in flight"),
+    http2: bool = typer.Option(False, help="Use HTTP/2 (needs `pip install httpx[http2]`)"),
+    progress: Optional[bool] = typer.Option(None, help="Show progress on stderr [default: when it is a terminal]"),
+):
+    """
+    Export dataElements (id, name, lastUpdated, optionally group ids) to CSV, NDJSON or Parquet.
+    Parquet needs pyarrow.
+    """
+    format = format or EXPORT_SUFFIXES.get(output.suffix.lower())
+    if format is None:
+        raise typer.BadParameter(f"Can't tell the format from {output.name!r}, use --format", param_hint="output")
+    if format is ExportFormat.parquet and pq is None:
+        raise typer.BadParameter("Parquet export needs pyarrow: pip install pyarrow", param_hint="--format")
+    url, username, password = resolve_connection(url, username, password)
+    if progress is None:
+        progress = sys.stderr.isatty()
+
+    async def run() -> int:
+        async with DHIS2Client(url, (username, password), concurrency=concurrency, http2=http2) as client:
+            return await export_data_elements(
+                client, output, format, groups=groups, page_size=page_size, progress=progress, stream=stream
+            )
+
+    run_and_report(run)
+
+
+@app.command()
+def sync(
+    url: Optional[str] = typer.Argument(None, help="Base URL of the API"),
+    username: Optional[str] = typer.Option(None, help="API username"),
+    password: Optional[str] = typer.Option(None, help="API password"),
+    resource: List[str] = typer.Option(
+        list(SYNC_RESOURCES), "--resource", "-r", help=f"Resource to sync, repeatable: {', '.join(SYNC_RESOURCES)}"
+    ),
+    cache: Path = typer.Option(Path("dhis2-metadata.db"), envvar="API_CACHE", help="SQLite file to sync into"),
+    page_size: int = typer.Option(1000, min=1, help="Objects per page"),
+    concurrency: int = typer.Option(16, min=1, help="Maximum number of requests in flight, across all resources"),
+    connections: Optional[int] = typer.Option(
+        None, min=1, help="Maximum connections to the server [default: --concurrency]"
+    ),
+    http2: bool = typer.Option(False, help="Use HTTP/2 (needs `pip install httpx[http2]`)"),
+    reconcile_hours: float = typer.Option(24, help="How often to check for deleted objects"),
+):
+    """
+    Sync several metadata resources into a local cache at the same time, then print how long each took.
+    """
+    unknown = sorted(set(resource) - set(SYNC_RESOURCES))
+    if unknown:
+        raise typer.BadParameter(f"Unknown resource {', '.join(unknown)}", param_hint="--resource")
+    url, username, password = resolve_connection(url, username, password)
+
+    async def run() -> list[SyncReport]:
+        async with DHIS2Client(
+            url, (username, password), concurrency=concurrency, connections=connections, http2=http2
+        ) as client:
+            with MetadataCache(cache) as store:
+                return await sync_all(
+                    client,
+                    store,
+                    list(dict.fromkeys(resource)),
+                    page_size=page_size,
+                    reconcile_every=reconcile_hours * 3600,
+                )
+
+    started = time.perf_counter()
+    reports = asyncio.run(run())
+    echo_sync_reports(reports, time.perf_counter() - started)
+    if any(report.error for report in reports):
+        raise typer.Exit(1)
+
+
 if __name__ == "__main__":
     app()
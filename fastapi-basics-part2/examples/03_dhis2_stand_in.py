@@ -0,0 +1,407 @@
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import secrets
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from functools import lru_cache
+from time import monotonic
+from typing import AsyncIterator, List, NamedTuple, Optional
+from urllib.parse import urlencode
+
+from fastapi import Depends, FastAPI, Form, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+# A local stand-in for the parts of the DHIS2 API the clients in this repo use, so
+# they can be benchmarked and tested without a live server:
+#
+#   uvicorn 03_dhis2_stand_in:app --port 8080
+#
+# Data elements are synthetic and computed from their index, so any number of them
+# costs no memory. Everything is configured with STANDIN_* environment variables.
+
+
+class StandInSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="STANDIN_")
+
+    objects: int = 10_000
+    # Used when a request gives no pageSize, like DHIS2 does
+    page_size: int = 50
+    # Added to every API response; jitter is a random extra of up to jitter_ms
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # Fraction of API requests answered with error_status instead
+    error_rate: float = 0.0
+    error_status: int = 503
+    # Fraction of data elements served without a name, which clients should reject
+    invalid_rate: float = 0.0
+    seed: Optional[int] = None
+
+    username: str = "admin"
+    password: str = "district"
+    client_id: str = "stand-in"
+    client_secret: str = "stand-in-secret"
+    token_ttl: int = 3600
+
+
+settings = StandInSettings()
+rng = random.Random(settings.seed)
+
+app = FastAPI(
+    title="DHIS2 Stand-in",
+    version="1.0.0",
+    description="Synthetic DHIS2 dataElements and OAuth2 endpoints with tunable latency and errors.",
+)
+
+stats = {
+    "requests": 0,
+    "injected_errors": 0,
+    "not_modified": 0,
+    "objects_served": 0,
+    "tokens_issued": 0,
+    "tokens_refreshed": 0,
+}
+
+
+# ---- Synthetic Data Elements ----
+
+UID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+VALUE_TYPES = ["NUMBER", "INTEGER_ZERO_OR_POSITIVE", "PERCENTAGE", "TEXT", "BOOLEAN"]
+CREATED = "2020-01-01T00:00:00.000"
+# lastUpdated values are spread evenly over this year, in index order
+UPDATED_FROM = datetime(2024, 1, 1)
+UPDATED_SPAN_MS = 365 * 24 * 3600 * 1000
+
+
+def uid(prefix: str, number: int) -> str:
+    """11-character DHIS2-style UID: a letter followed by `number` in base 62."""
+    digits = []
+    for _ in range(10):
+        number, digit = divmod(number, 62)
+        digits.append(UID_ALPHABET[digit])
+    return prefix + "".join(reversed(digits))
+
+
+def updated_ms(index: int) -> int:
+    return index * UPDATED_SPAN_MS // max(1, settings.objects)
+
+
+def format_timestamp(ms: int) -> str:
+    return (UPDATED_FROM + timedelta(milliseconds=ms)).isoformat(timespec="milliseconds")
+
+
+def group_count() -> int:
+    return max(1, settings.objects // 50)
+
+
+def is_invalid(index: int) -> bool:
+    """Whether data element `index` is one of the broken ones: a fixed, evenly spread choice."""
+    return index * 2654435761 % 1_000_003 < settings.invalid_rate * 1_000_003
+
+
+def data_element(index: int) -> dict:
+    groups = group_count()
+    group_numbers = dict.fromkeys([index % groups, index * 7 % groups] if index % 3 == 0 else [index % groups])
+    name = None if is_invalid(index) else f"Data element {index}"
+    return {
+        "id": uid("d", index),
+        "code": f"DE_{index}",
+        "name": name,
+        "displayName": name,
+        "shortName": f"DE {index}",
+        "valueType": VALUE_TYPES[index % len(VALUE_TYPES)],
+        "domainType": "AGGREGATE",
+        "created": CREATED,
+        "lastUpdated": format_timestamp(updated_ms(index)),
+        "dataElementGroups": [
+            {"id": uid("g", group), "name": f"Group {group}", "displayName": f"Group {group}"}
+            for group in group_numbers
+        ],
+    }
+
+
+# ---- Query Parameters ----
+
+
+@lru_cache(maxsize=256)
+def parse_fields(spec: str) -> Optional[dict]:
+    """
+    Parse a DHIS2 `fields` parameter: "id,name,dataElementGroups[id]" gives
+    {"id": None, "name": None, "dataElementGroups": {"id": None}}. None means all fields.
+    """
+
+    def parse(position: int) -> tuple[Optional[dict], int]:
+        fields: Optional[dict] = {}
+        name = ""
+        while position < len(spec):
+            char = spec[position]
+            if char == "[":
+                fields[name.strip()], position = parse(position + 1)
+                name = ""
+            elif char in ",]":
+                if name.strip() in ("*", ":all"):
+                    fields = None
+                elif name.strip() and fields is not None:
+                    fields[name.strip()] = None
+                name = ""
+                if char == "]":
+                    return fields, position + 1
+            else:
+                name += char
+            position += 1
+        if name.strip() in ("*", ":all"):
+            return None, position
+        if name.strip() and fields is not None:
+            fields[name.strip()] = None
+        return fields, position
+
+    return parse(0)[0]
+
+
+def select(value, fields: Optional[dict]):
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        return [select(item, fields) for item in value]
+    return {key: select(value[key], sub) for key, sub in fields.items() if key in value}
+
+
+class IndexRange(NamedTuple):
+    start: int
+    stop: int
+
+
+def filter_range(filters: List[str]) -> IndexRange:
+    """
+    The data elements matching all `filters`. Only lastUpdated filters (gt, ge, lt,
+    le, eq) are supported; since lastUpdated grows with the index, each one cuts the
+    index range and no element has to be looked at.
+    """
+    start, stop = 0, settings.objects
+    indices = range(settings.objects)
+    for expression in filters:
+        try:
+            prop, operator, value = expression.split(":", 2)
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unsupported filter: {expression}")
+        if prop != "lastUpdated" or operator not in ("gt", "ge", "lt", "le", "eq"):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unsupported filter: {expression}")
+
+        ms = (moment - UPDATED_FROM) // timedelta(milliseconds=1)
+        first_at_or_after = bisect_left(indices, ms, key=updated_ms)
+        first_after = bisect_left(indices, ms + 1, key=updated_ms)
+        if operator in ("gt", "ge"):
+            start = max(start, first_after if operator == "gt" else first_at_or_after)
+        if operator in ("lt", "le"):
+            stop = min(stop, first_at_or_after if operator == "lt" else first_after)
+        if operator == "eq":
+            start, stop = max(start, first_at_or_after), min(stop, first_after)
+    return IndexRange(start, max(start, stop))
+
+
+# ---- Authentication ----
+
+
+class AuthCode(NamedTuple):
+    redirect_uri: str
+    code_challenge: str
+    code_challenge_method: str
+    expires_at: float
+
+
+auth_codes: dict[str, AuthCode] = {}
+access_tokens: dict[str, float] = {}
+refresh_tokens: set[str] = set()
+
+
+def authenticate(authorization: Optional[str] = Header(None)) -> str:
+    """Accept HTTP Basic with the configured user, or a Bearer token from /oauth2/token."""
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() == "basic":
+        username, _, password = base64.b64decode(credentials).decode(errors="replace").partition(":")
+        if secrets.compare_digest(username, settings.username) and secrets.compare_digest(password, settings.password):
+            return username
+    elif scheme.lower() == "bearer":
+        expires_at = access_tokens.get(credentials)
+        if expires_at is not None and expires_at > monotonic():
+            return settings.username
+    raise HTTPException(
+        status.HTTP_401_UNAUTHORIZED, "Unauthorized", headers={"WWW-Authenticate": 'Basic realm="DHIS2"'}
+    )
+
+
+async def simulate_network() -> None:
+    """Delay like a remote server would, and fail a share of requests."""
+    stats["requests"] += 1
+    delay = settings.latency_ms + rng.random() * settings.jitter_ms
+    if delay:
+        await asyncio.sleep(delay / 1000)
+    if settings.error_rate and rng.random() < settings.error_rate:
+        stats["injected_errors"] += 1
+        raise HTTPException(settings.error_status, "Injected error")
+
+
+# ---- API ----
+
+
+async def stream_objects(key: str, indices: range, fields: Optional[dict]) -> AsyncIterator[bytes]:
+    """The whole `{key: [...]}` document, encoded a thousand objects at a time."""
+    yield b'{"%s":[' % key.encode()
+    for start in range(indices.start, indices.stop, 1000):
+        chunk = range(start, min(indices.stop, start + 1000))
+        encoded = json.dumps([select(data_element(index), fields) for index in chunk], separators=(",", ":"))
+        yield (b"," if start > indices.start else b"") + encoded[1:-1].encode()
+        stats["objects_served"] += len(chunk)
+        # Let other requests in between chunks
+        await asyncio.sleep(0)
+    yield b"]}"
+
+
+@app.get("/api/me", tags=["API"])
+async def me(username: str = Depends(authenticate)):
+    await simulate_network()
+    return {"id": uid("u", 1), "username": username, "displayName": "Stand-in Admin"}
+
+
+@app.get("/api/system/info", tags=["API"])
+async def system_info(username: str = Depends(authenticate)):
+    await simulate_network()
+    # Local time without an offset, like lastUpdated
+    return {"version": "2.40.0", "serverDate": datetime.now().isoformat(timespec="milliseconds")}
+
+
+@app.get("/api/dataElements", tags=["API"])
+async def data_elements(
+    request: Request,
+    username: str = Depends(authenticate),
+    fields: str = "id,displayName",
+    paging: bool = True,
+    page: int = Query(1, ge=1),
+    page_size: Optional[int] = Query(None, alias="pageSize", ge=1),
+    filter: List[str] = Query([]),
+    if_none_match: Optional[str] = Header(None),
+):
+    await simulate_network()
+    selected = parse_fields(fields)
+    matching = filter_range(filter)
+
+    # The data never changes, so a response is identified by its query alone
+    etag = '"%s"' % hashlib.sha256(f"{settings.objects}?{request.url.query}".encode()).hexdigest()[:32]
+    if if_none_match == etag:
+        stats["not_modified"] += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    if not paging:
+        indices = range(matching.start, matching.stop)
+        return StreamingResponse(
+            stream_objects("dataElements", indices, selected), media_type="application/json", headers={"ETag": etag}
+        )
+
+    page_size = page_size or settings.page_size
+    total = matching.stop - matching.start
+    page_count = max(1, -(-total // page_size))
+    start = min(matching.stop, matching.start + (page - 1) * page_size)
+    indices = range(start, min(matching.stop, start + page_size))
+    pager = {"page": page, "total": total, "pageSize": page_size, "pageCount": page_count}
+    if page < page_count:
+        pager["nextPage"] = str(request.url.include_query_params(page=page + 1))
+    stats["objects_served"] += len(indices)
+    body = {"pager": pager, "dataElements": [select(data_element(index), selected) for index in indices]}
+    return JSONResponse(body, headers={"ETag": etag})
+
+
+# ---- OAuth2 ----
+
+
+def oauth_error(error: str, description: str) -> JSONResponse:
+    return JSONResponse({"error": error, "error_description": description}, status_code=status.HTTP_400_BAD_REQUEST)
+
+
+@app.get("/oauth2/authorize", tags=["OAuth2"])
+async def authorize(
+    client_id: str,
+    redirect_uri: str,
+    response_type: str = "code",
+    state: str = "",
+    scope: str = "",
+    code_challenge: str = "",
+    code_challenge_method: str = "plain",
+):
+    """Approves every request straight away and redirects back with a code: there is no login page."""
+    if client_id != settings.client_id:
+        return oauth_error("invalid_client", "Unknown client_id")
+    if response_type != "code":
+        return oauth_error("unsupported_response_type", "Only the authorization code flow is supported")
+
+    code = secrets.token_urlsafe(24)
+    auth_codes[code] = AuthCode(redirect_uri, code_challenge, code_challenge_method, monotonic() + 60)
+    return RedirectResponse(f"{redirect_uri}?{urlencode({'code': code, 'state': state})}", status_code=302)
+
+
+def issue_token(refresh_token: Optional[str] = None) -> dict:
+    access_token = secrets.token_urlsafe(32)
+    access_tokens[access_token] = monotonic() + settings.token_ttl
+    token = {"access_token": access_token, "token_type": "Bearer", "expires_in": settings.token_ttl, "scope": "ALL"}
+    if refresh_token is None:
+        refresh_token = secrets.token_urlsafe(32)
+        refresh_tokens.add(refresh_token)
+        # Like many servers, a refresh only returns a new access token
+        token["refresh_token"] = refresh_token
+    return token
+
+
+@app.post("/oauth2/token", tags=["OAuth2"])
+async def token(
+    grant_type: str = Form(...),
+    code: Optional[str] = Form(None),
+    redirect_uri: Optional[str] = Form(None),
+    code_verifier: Optional[str] = Form(None),
+    refresh_token: Optional[str] = Form(None),
+    client_id: Optional[str] = Form(None),
+    client_secret: Optional[str] = Form(None),
+):
+    if client_id != settings.client_id or client_secret != settings.client_secret:
+        return JSONResponse({"error": "invalid_client"}, status_code=status.HTTP_401_UNAUTHORIZED)
+
+    if grant_type == "authorization_code":
+        grant = auth_codes.pop(code or "", None)
+        if grant is None or grant.expires_at < monotonic() or grant.redirect_uri != redirect_uri:
+            return oauth_error("invalid_grant", "Unknown, expired or mismatched code")
+        verifier = code_verifier or ""
+        if grant.code_challenge_method == "S256":
+            digest = hashlib.sha256(verifier.encode("ascii")).digest()
+            verifier = base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+        if grant.code_challenge and not secrets.compare_digest(verifier, grant.code_challenge):
+            return oauth_error("invalid_grant", "PKCE verification failed")
+        stats["tokens_issued"] += 1
+        return issue_token()
+
+    if grant_type == "refresh_token":
+        if refresh_token not in refresh_tokens:
+            return oauth_error("invalid_grant", "Unknown refresh token")
+        stats["tokens_refreshed"] += 1
+        return issue_token(refresh_token)
+
+    return oauth_error("unsupported_grant_type", f"Unsupported grant_type: {grant_type}")
+
+
+# ---- Stand-in ----
+
+
+@app.get("/stand-in/stats", tags=["Stand-in"])
+async def stand_in_stats():
+    """Request counters, e.g. to see how many requests or retries a client needed."""
+    return {
+        **stats,
+        "invalid_objects": invalid_objects(),
+        "settings": settings.model_dump(exclude={"password", "client_secret"}),
+    }
+
+
+@lru_cache(maxsize=1)
+def invalid_objects() -> int:
+    return sum(map(is_invalid, range(settings.objects))) if settings.invalid_rate else 0
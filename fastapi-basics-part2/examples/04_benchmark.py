@@ -0,0 +1,322 @@
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import httpx
+import typer
+
+# Runs the clients in this repo against the stand-in server (03_dhis2_stand_in.py)
+# and reports time, throughput and peak memory for each:
+#
+#   python 04_benchmark.py --objects 100000 --latency-ms 20 --error-rate 0.02
+#
+# Each client runs in its own process, so its peak RSS can be measured separately.
+
+app = typer.Typer()
+
+EXAMPLES = Path(__file__).resolve().parent
+REPO = EXAMPLES.parent.parent
+CLI = EXAMPLES / "02_typer_cli2.py"
+PYDANTIC_DHIS2 = REPO / "pydantic-basics" / "examples" / "01_dhis2.py"
+OAUTH_DEMO = REPO / "dhis2-oauth-cli" / "oauth_demo.py"
+
+USERNAME, PASSWORD = "admin", "district"
+CLIENT_ID, CLIENT_SECRET = "stand-in", "stand-in-secret"
+
+
+class Case(NamedTuple):
+    name: str
+    argv: list[str]
+    env: dict[str, str]
+    # Objects the client handles, for the objects/s column; None if that means nothing here
+    objects: Optional[int] = None
+    # File the client writes, or None for its stdout, and the lines it should end up with
+    output: Optional[Path] = None
+    expected_lines: Optional[int] = None
+    # Text that must appear on stdout
+    expected_text: Optional[str] = None
+    # Answer the login URL printed by oauth_demo.py like a browser would
+    browser: bool = False
+
+
+class Result(NamedTuple):
+    name: str
+    seconds: float
+    objects_per_second: Optional[float]
+    peak_rss_mb: float
+    requests: int
+    status: str
+
+
+# ---- Stand-in Server ----
+
+
+class StandIn:
+    """The stand-in server running in a uvicorn subprocess for as long as the `with` block."""
+
+    def __init__(self, python: str, port: int, settings: dict, log: Path) -> None:
+        self.url = f"http://127.0.0.1:{port}"
+        self.argv = [python, "-m", "uvicorn", "03_dhis2_stand_in:app", "--app-dir", str(EXAMPLES)]
+        self.argv += ["--port", str(port), "--log-level", "warning"]
+        self.env = {**os.environ, **{f"STANDIN_{key.upper()}": str(value) for key, value in settings.items()}}
+        self.log = log
+
+    def __enter__(self) -> "StandIn":
+        with open(self.log, "wb") as log:
+            self.process = subprocess.Popen(self.argv, env=self.env, stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Stand-in server exited:\n{self.log.read_text()}")
+            try:
+                self.stats()
+                return self
+            except httpx.TransportError:
+                time.sleep(0.1)
+        self.process.kill()
+        raise RuntimeError(f"Stand-in server did not start:\n{self.log.read_text()}")
+
+    def __exit__(self, *exc) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+    def stats(self) -> dict:
+        return httpx.get(f"{self.url}/stand-in/stats").json()
+
+
+# ---- Cases ----
+
+
+def build_cases(python: str, server: StandIn, work: Path, objects: int, page_size: int, concurrency: int) -> List[Case]:
+    cli = [python, str(CLI)]
+    connection = [server.url, "--username", USERNAME, "--password", PASSWORD]
+    tuning = ["--page-size", str(page_size), "--concurrency", str(concurrency)]
+    cache = work / "cache.db"
+    # Clients skip the data elements the server breaks on purpose
+    valid = objects - server.stats()["invalid_objects"]
+    cases = [
+        Case("fetch-data", [*cli, "fetch-data", *connection, *tuning], {}, objects, expected_lines=valid),
+        Case(
+            "fetch-data --stream",
+            [*cli, "fetch-data", *connection, *tuning, "--stream"],
+            {},
+            objects,
+            expected_lines=valid,
+        ),
+        Case(
+            "fetch-data --cache (first)",
+            [*cli, "fetch-data", *connection, *tuning, "--cache", str(cache)],
+            {},
+            objects,
+            expected_lines=valid,
+        ),
+        # Only fetches what changed since the first run, then prints from the cache
+        Case(
+            "fetch-data --cache (again)",
+            [*cli, "fetch-data", *connection, *tuning, "--cache", str(cache)],
+            {},
+            objects,
+            expected_lines=valid,
+        ),
+        Case(
+            "export csv",
+            [*cli, "export", str(work / "out.csv"), *connection, *tuning, "--groups"],
+            {},
+            objects,
+            work / "out.csv",
+            valid + 1,
+        ),
+        Case(
+            "export ndjson --stream",
+            [*cli, "export", str(work / "out.ndjson"), *connection, *tuning, "--groups", "--stream"],
+            {},
+            objects,
+            work / "out.ndjson",
+            valid,
+        ),
+    ]
+    if importlib.util.find_spec("pyarrow"):
+        cases.append(
+            Case(
+                "export parquet",
+                [*cli, "export", str(work / "out.parquet"), *connection, *tuning, "--groups"],
+                {},
+                objects,
+            )
+        )
+
+    dhis2 = {"DHIS2_URL": server.url, "DHIS2_USERNAME": USERNAME, "DHIS2_PASSWORD": PASSWORD}
+    cases += [
+        Case("01_dhis2 (whole response)", [python, str(PYDANTIC_DHIS2)], dhis2, objects),
+        Case(
+            "01_dhis2 DHIS2_STREAM",
+            [python, str(PYDANTIC_DHIS2)],
+            {**dhis2, "DHIS2_STREAM": "1"},
+            objects,
+            expected_text=f"Data elements: {valid}",
+        ),
+        Case("01_dhis2 DHIS2_GRAPH", [python, str(PYDANTIC_DHIS2)], {**dhis2, "DHIS2_GRAPH": "1"}, objects),
+    ]
+
+    oauth = {
+        "SERVER_BASE_URL": server.url,
+        "CLIENT_ID": CLIENT_ID,
+        "CLIENT_SECRET": CLIENT_SECRET,
+        "SCOPE": "ALL",
+        "REDIRECT_URI": f"http://127.0.0.1:{free_port()}/callback",
+        "API_ENDPOINT": "/api/me",
+        "TOKEN_CACHE": str(work / "tokens.bin"),
+        # The prompt for the login URL has to come through before the process exits
+        "PYTHONUNBUFFERED": "1",
+        # act_as_browser follows the login URL; `webbrowser` runs `true` instead of opening a real one
+        "BROWSER": "true",
+    }
+    cases += [
+        Case("oauth_demo (login)", [python, str(OAUTH_DEMO)], oauth, expected_text="Status: 200", browser=True),
+        Case("oauth_demo (cached token)", [python, str(OAUTH_DEMO)], oauth, expected_text="Status: 200"),
+    ]
+    return cases
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ---- Running ----
+
+
+def act_as_browser(stdout, log) -> None:
+    """Copy stdout to `log`, following the login URL once oauth_demo.py prints it and listens for the redirect."""
+    auth_url = None
+    for line in stdout:
+        log.write(line)
+        if line.startswith("Full encoded auth URL:"):
+            auth_url = line.split(":", 1)[1].strip()
+        elif auth_url and line.startswith("Starting local server"):
+            # The redirect lands on oauth_demo.py's own server, which answers it and shuts down
+            httpx.get(auth_url, follow_redirects=True, timeout=10)
+            auth_url = None
+
+
+def run_case(case: Case, cwd: Path, timeout: float) -> tuple[float, float, str]:
+    """Run one client and return its wall time, peak RSS in MB and status."""
+    stdout_path = cwd / "stdout.txt"
+    stderr_path = cwd / "stderr.txt"
+    with open(stdout_path, "w") as stdout, open(stderr_path, "w") as stderr:
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            case.argv,
+            cwd=cwd,
+            env={**os.environ, **case.env},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if case.browser else stdout,
+            stderr=stderr,
+            text=True,
+        )
+        watchdog = threading.Timer(timeout, process.kill)
+        watchdog.start()
+        try:
+            if case.browser:
+                act_as_browser(process.stdout, stdout)
+            # wait4 rather than Popen.wait: it also returns the child's resource usage
+            _, wait_status, usage = os.wait4(process.pid, 0)
+        finally:
+            watchdog.cancel()
+        seconds = time.perf_counter() - started
+
+    # ru_maxrss is in KiB on Linux
+    peak_rss_mb = usage.ru_maxrss / 1024
+    exit_code = os.waitstatus_to_exitcode(wait_status)
+    if exit_code:
+        tail = stderr_path.read_text().strip().splitlines()[-1:]
+        return seconds, peak_rss_mb, f"exit {exit_code}" + (f": {tail[0][:60]}" if tail else "")
+
+    output = case.output or stdout_path
+    if case.expected_lines is not None:
+        with open(output, "rb") as f:
+            lines = sum(1 for _ in f)
+        if lines != case.expected_lines:
+            return seconds, peak_rss_mb, f"{lines} lines, expected {case.expected_lines}"
+    if case.expected_text is not None and case.expected_text not in stdout_path.read_text():
+        return seconds, peak_rss_mb, f"no {case.expected_text!r} in output"
+    return seconds, peak_rss_mb, "ok"
+
+
+def print_results(results: List[Result]) -> None:
+    typer.echo(f"{'case':<28} {'seconds':>8} {'objects/s':>10} {'peak MB':>8} {'requests':>8}  status")
+    for result in results:
+        rate = f"{result.objects_per_second:,.0f}" if result.objects_per_second else "-"
+        typer.echo(
+            f"{result.name:<28} {result.seconds:>8.2f} {rate:>10} {result.peak_rss_mb:>8.1f} "
+            f"{result.requests:>8}  {result.status}"
+        )
+
+
+@app.command()
+def run(
+    objects: int = typer.Option(100_000, min=1, help="Data elements on the stand-in server"),
+    latency_ms: float = typer.Option(20, min=0, help="Latency the server adds to every API request"),
+    jitter_ms: float = typer.Option(5, min=0, help="Random extra latency of up to this much"),
+    error_rate: float = typer.Option(0.0, min=0, max=1, help="Fraction of API requests failing with a 503"),
+    invalid_rate: float = typer.Option(0.0, min=0, max=1, help="Fraction of data elements that fail validation"),
+    page_size: int = typer.Option(1000, min=1, help="Page size the clients ask for"),
+    concurrency: int = typer.Option(8, min=1, help="Requests in flight for the clients that take --concurrency"),
+    case: List[str] = typer.Option([], help="Only run cases whose name contains this, repeatable"),
+    port: int = typer.Option(8765, help="Port for the stand-in server"),
+    python: str = typer.Option(sys.executable, help="Python to run the server and clients with"),
+    timeout: float = typer.Option(600, help="Seconds before a client is killed"),
+    output: Optional[Path] = typer.Option(None, help="Also write the results to this JSON file"),
+):
+    """
+    Start the stand-in server, run each client against it and print time, throughput, peak memory and requests.
+    """
+    settings = {
+        "objects": objects,
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "error_rate": error_rate,
+        "invalid_rate": invalid_rate,
+        "seed": 0,
+        "username": USERNAME,
+        "password": PASSWORD,
+        "client_id": CLIENT_ID,
+        "client_secret": CLIENT_SECRET,
+    }
+    results = []
+    with tempfile.TemporaryDirectory(prefix="dhis2-benchmark-") as tmp:
+        work = Path(tmp)
+        with StandIn(python, port, settings, work / "server.log") as server:
+            cases = build_cases(python, server, work, objects, page_size, concurrency)
+            for selected in cases:
+                if case and not any(part in selected.name for part in case):
+                    continue
+                typer.echo(f"… {selected.name}", err=True)
+                before = server.stats()["requests"]
+                seconds, peak_rss_mb, status = run_case(selected, work, timeout)
+                requests = server.stats()["requests"] - before
+                rate = selected.objects / seconds if selected.objects and status == "ok" else None
+                results.append(Result(selected.name, seconds, rate, peak_rss_mb, requests, status))
+
+    typer.echo(
+        f"\n{objects:,} objects ({invalid_rate:.1%} invalid), {latency_ms:g}+{jitter_ms:g} ms latency, "
+        f"{error_rate:.0%} errors\n"
+    )
+    print_results(results)
+    if output:
+        output.write_text(json.dumps([result._asdict() for result in results], indent=2))
+    if any(result.status != "ok" for result in results):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
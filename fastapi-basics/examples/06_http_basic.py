@@ -1,4 +1,13 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 from secrets import compare_digest
+from time import monotonic
+from typing import Protocol
 
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
@@ -12,25 +21,208 @@ app = FastAPI(
 # Security scheme
 security = HTTPBasic()
 
-# Dummy user store (you could fetch from a DB instead)
-VALID_USERS = {"admin": "s3cret", "demo": "test123"}
 
+# ---- Password Hashing ----
+# Hashes are stored as `scrypt$n$r$p$salt$hash` or `pbkdf2_sha256$iterations$salt$hash`,
+# with salt and hash base64-encoded, so the parameters can be raised later without
+# invalidating existing hashes.
 
-def verify_credentials(credentials: HTTPBasicCredentials = Depends(security)) -> str:
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password: str, scheme: str = "scrypt") -> str:
+    """Hash `password` with a fresh random salt, using scrypt or PBKDF2-SHA256."""
+    salt = secrets.token_bytes(16)
+    if scheme == "scrypt":
+        n, r, p = 2**14, 8, 1
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p)
+        return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+    if scheme == "pbkdf2_sha256":
+        iterations = 600_000
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        return f"pbkdf2_sha256${iterations}${_b64(salt)}${_b64(digest)}"
+    raise ValueError(f"Unknown password hash scheme: {scheme}")
+
+
+def verify_password(password: str, encoded: str) -> bool:
+    """Check `password` against a hash made by `hash_password`. Slow by design."""
+    scheme, *params = encoded.split("$")
+    if scheme == "scrypt":
+        n, r, p, salt, expected = params
+        digest = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=int(n), r=int(r), p=int(p))
+    elif scheme == "pbkdf2_sha256":
+        iterations, salt, expected = params
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(salt), int(iterations))
+    else:
+        return False
+    return compare_digest(digest, base64.b64decode(expected))
+
+
+# ---- User Store ----
+
+
+class UserStore(Protocol):
+    """Anything that can look up the password hash of a user, e.g. a database table."""
+
+    def get_password_hash(self, username: str) -> str | None: ...
+
+
+class InMemoryUserStore:
+    def __init__(self, hashes: dict[str, str]) -> None:
+        self._hashes = hashes
+
+    def get_password_hash(self, username: str) -> str | None:
+        return self._hashes.get(username)
+
+    def set_password(self, username: str, password: str) -> None:
+        self._hashes[username] = hash_password(password)
+
+
+# Dummy users (you could fetch from a DB instead); only their hashes are kept
+user_store: UserStore = InMemoryUserStore(
+    {username: hash_password(password) for username, password in {"admin": "s3cret", "demo": "test123"}.items()}
+)
+
+# Checked for unknown users too, so a wrong username takes as long as a wrong password
+DUMMY_HASH = hash_password(secrets.token_urlsafe())
+
+
+# ---- Credential Checks ----
+
+
+class CredentialCache:
+    """
+    Remembers credential pairs that recently passed the slow hash check.
+
+    Entries are keyed by an HMAC of username, password and stored hash under a
+    per-process secret, so the cache never holds a password and an entry stops
+    matching as soon as the user's password changes.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10_000) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._secret = secrets.token_bytes(32)
+        self._entries: dict[bytes, float] = {}
+
+    def key(self, username: str, password: str, password_hash: str) -> bytes:
+        message = "\0".join((username, password, password_hash)).encode()
+        return hmac.digest(self._secret, message, "sha256")
+
+    def __contains__(self, key: bytes) -> bool:
+        expires_at = self._entries.get(key)
+        return expires_at is not None and expires_at > monotonic()
+
+    def add(self, key: bytes) -> None:
+        if len(self._entries) >= self.max_size:
+            now = monotonic()
+            self._entries = {k: expires_at for k, expires_at in self._entries.items() if expires_at > now}
+            if len(self._entries) >= self.max_size:
+                self._entries.clear()
+        self._entries[key] = monotonic() + self.ttl
+
+
+class FailureThrottle:
+    """
+    Locks a username for `lockout` seconds after `max_failures` failed logins within
+    `window` seconds, so passwords cannot be guessed at hashing speed.
+    """
+
+    def __init__(self, max_failures: int, window: float, lockout: float, max_users: int = 100_000) -> None:
+        self.max_failures = max_failures
+        self.window = window
+        self.lockout = lockout
+        self.max_users = max_users
+        # username -> (failures, first failure, locked until)
+        self._failures: dict[str, tuple[int, float, float]] = {}
+
+    def retry_after(self, username: str) -> float:
+        """Seconds until `username` may try again, or 0 if it is not locked."""
+        entry = self._failures.get(username)
+        return max(0.0, entry[2] - monotonic()) if entry else 0.0
+
+    def failed(self, username: str) -> None:
+        now = monotonic()
+        if len(self._failures) >= self.max_users:
+            # Guesses at many made-up usernames must not grow this without limit
+            self._failures = {
+                user: entry for user, entry in self._failures.items() if now - entry[1] <= self.window or entry[2] > now
+            }
+        count, first, _ = self._failures.get(username, (0, now, 0.0))
+        if now - first > self.window:
+            count, first = 0, now
+        count += 1
+        locked_until = now + self.lockout if count >= self.max_failures else 0.0
+        self._failures[username] = (count, first, locked_until)
+
+    def succeeded(self, username: str) -> None:
+        self._failures.pop(username, None)
+
+
+credential_cache = CredentialCache(ttl=float(os.getenv("AUTH_CACHE_TTL", "60")))
+throttle = FailureThrottle(max_failures=5, window=300, lockout=60)
+
+# Hash checks run here: hashlib releases the GIL, so they use other cores and never block the event loop
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "4"))
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+# Hash checks allowed to wait for a worker before new ones are refused
+MAX_PENDING_HASHES = HASH_WORKERS * 8
+pending_hashes = 0
+
+
+async def check_password(password: str, password_hash: str) -> bool:
+    global pending_hashes
+    if pending_hashes >= MAX_PENDING_HASHES:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    pending_hashes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, verify_password, password, password_hash)
+    finally:
+        pending_hashes -= 1
+
+
+async def verify_credentials(credentials: HTTPBasicCredentials = Depends(security)) -> str:
     """
-    Verify user credentials against a simple in-memory store.
+    Verify user credentials against the hashed user store.
     Returns the username if valid, raises HTTPException otherwise.
+
+    Credentials that passed recently are answered from `credential_cache` without
+    hashing; everything else is hashed in `hash_executor`.
     """
-    correct_password = VALID_USERS.get(credentials.username)
+    username = credentials.username
+
+    retry_after = throttle.retry_after(username)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed logins, try again later",
+            headers={"Retry-After": str(int(retry_after) + 1)},
+        )
+
+    password_hash = user_store.get_password_hash(username)
+    cache_key = credential_cache.key(username, credentials.password, password_hash or "")
+    if password_hash is not None and cache_key in credential_cache:
+        return username
 
-    if not correct_password or not compare_digest(credentials.password, correct_password):
+    valid = await check_password(credentials.password, password_hash or DUMMY_HASH)
+    if not valid or password_hash is None:
+        throttle.failed(username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    return credentials.username
+    throttle.succeeded(username)
+    credential_cache.add(cache_key)
+    return username
 
 
 @app.get("/", tags=["Public"])
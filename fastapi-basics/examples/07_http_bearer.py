@@ -1,42 +1,210 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from time import monotonic, time
+
+import typer
 from fastapi import Depends, FastAPI, HTTPException, Security, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from joserfc import jwt
+from joserfc.jwk import ECKey, KeySet
+from joserfc.jwt import JWTClaimsRegistry
+
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI(
     title="HTTP Bearer Auth Example",
     version="1.0.0",
-    description="Example using HTTP Bearer token in Authorization header.",
+    description="Example using a signed JWT as HTTP Bearer token in the Authorization header.",
 )
 
 # Define the bearer scheme (no auto_error so we can return custom messages)
 bearer_scheme = HTTPBearer(auto_error=False)
 
-# Dummy valid token (usually you'd check this against a database or JWT)
-VALID_TOKENS = {"mysecrettoken", "another-valid-token"}
+# Signing keys are read from a JWKS file; run `python 07_http_bearer.py add-key` to create or rotate one
+JWKS_PATH = Path(os.getenv("JWKS_PATH", "jwks.json"))
+ALGORITHMS = ["ES256", "RS256", "EdDSA"]
+
+
+class TokenVerifier:
+    """
+    Verifies JWT bearer tokens against a JWKS file, picking the key by the token's `kid`.
+
+    The file is checked for changes at most every `check_interval` seconds and
+    reloaded when it changed, so keys can be rotated without a restart. Verified
+    claims are cached by token digest until the token expires, so a token costs
+    one signature check for its whole lifetime. The cache is cleared whenever the
+    keys change, which also revokes tokens signed with a removed key.
+    """
+
+    def __init__(self, jwks_path: Path, check_interval: float = 1.0, max_size: int = 100_000) -> None:
+        self.jwks_path = jwks_path
+        self.check_interval = check_interval
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        options = {"exp": {"essential": True}}
+        if os.getenv("JWT_ISSUER"):
+            options["iss"] = {"essential": True, "value": os.environ["JWT_ISSUER"]}
+        if os.getenv("JWT_AUDIENCE"):
+            options["aud"] = {"essential": True, "value": os.environ["JWT_AUDIENCE"]}
+        self.claims_registry = JWTClaimsRegistry(**options)
+        self._keys: KeySet | None = None
+        self._stamp: tuple[int, int] | None = None
+        self._next_check = 0.0
+        self._claims: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+
+    def _refresh_keys(self) -> KeySet | None:
+        now = monotonic()
+        if now < self._next_check:
+            return self._keys
+        self._next_check = now + self.check_interval
+
+        try:
+            stat = self.jwks_path.stat()
+        except FileNotFoundError:
+            return self._keys
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return self._keys
+
+        try:
+            keys = KeySet.import_key_set(json.loads(self.jwks_path.read_bytes()))
+        except (OSError, ValueError) as e:
+            # Most likely caught halfway through a write; keep the current keys and look again next time
+            logger.warning("Could not load %s, keeping the current keys: %s", self.jwks_path, e)
+            return self._keys
 
+        self._keys, self._stamp = keys, stamp
+        self._claims.clear()
+        self.reloads += 1
+        logger.info("Loaded %d signing keys from %s", len(keys.keys), self.jwks_path)
+        return keys
 
-def verify_bearer_token(credentials: HTTPAuthorizationCredentials = Security(bearer_scheme)) -> str:
+    def verify(self, token: str) -> dict:
+        """Return the claims of `token`. Raises a joserfc error if the token or its claims are not valid."""
+        keys = self._refresh_keys()
+        if keys is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No signing keys configured")
+
+        digest = hashlib.sha256(token.encode()).digest()
+        cached = self._claims.get(digest)
+        hit = cached is not None and cached[0] > time()
+        if hit:
+            self._claims.move_to_end(digest)
+            self.hits += 1
+            claims = cached[1]
+        else:
+            self.misses += 1
+            claims = jwt.decode(token, keys, algorithms=ALGORITHMS).claims
+
+        # Claims are validated on every request, since a cached token can expire in the meantime
+        self.claims_registry.validate(claims)
+
+        if not hit:
+            self._claims[digest] = (claims["exp"], claims)
+            if len(self._claims) > self.max_size:
+                self._claims.popitem(last=False)
+        return claims
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._keys.keys) if self._keys else 0,
+            "reloads": self.reloads,
+            "cached_tokens": len(self._claims),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+verifier = TokenVerifier(JWKS_PATH)
+
+
+async def verify_bearer_token(credentials: HTTPAuthorizationCredentials = Security(bearer_scheme)) -> dict:
     if not credentials or credentials.scheme.lower() != "bearer":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Authorization token missing or wrong scheme",
         )
 
-    token = credentials.credentials
-
-    if token not in VALID_TOKENS:
+    # A cache hit takes microseconds, so this runs on the event loop instead of in a worker thread
+    try:
+        return verifier.verify(credentials.credentials)
+    except HTTPException:
+        raise
+    except Exception:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid token",
         )
 
-    return token
-
 
 @app.get("/", tags=["Public"])
 async def root():
     return {"message": "Welcome! Try the /secure endpoint with Bearer token."}
 
 
+@app.get("/auth/stats", tags=["Public"])
+async def auth_stats():
+    return verifier.stats()
+
+
 @app.get("/secure", tags=["Protected"])
-async def read_secure(token: str = Depends(verify_bearer_token)):
-    return {"message": "Access granted with token", "token_used": token}
+async def read_secure(claims: dict = Depends(verify_bearer_token)):
+    return {"message": "Access granted with token", "subject": claims.get("sub"), "expires": claims["exp"]}
+
+
+# ---- Key Management CLI ----
+
+cli = typer.Typer()
+
+
+def read_key_set() -> KeySet:
+    if not JWKS_PATH.exists():
+        return KeySet([])
+    return KeySet.import_key_set(json.loads(JWKS_PATH.read_bytes()))
+
+
+@cli.command()
+def add_key(keep: int = typer.Option(2, help="Number of most recent keys to keep")):
+    """
+    Add a new ES256 signing key to the JWKS file and drop all but the `keep` newest,
+    so tokens signed with the previous key stay valid until they expire.
+
+    The file keeps the private keys so `issue-token` can sign with them; a server
+    that only verifies tokens needs just the public parts.
+    """
+    key = ECKey.generate_key("P-256", parameters={"alg": "ES256"}, private=True)
+    # The RFC 7638 thumbprint makes a unique `kid`
+    key.ensure_kid()
+    keys = [*read_key_set().keys, key][-keep:]
+
+    tmp = JWKS_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(KeySet(keys).as_dict(private=True), indent=2))
+    # Replace atomically so the server never reads a half-written file
+    tmp.replace(JWKS_PATH)
+    typer.echo(f"Added key {key.kid}; {JWKS_PATH} now has {len(keys)} keys")
+
+
+@cli.command()
+def issue_token(sub: str = "demo", minutes: int = 60):
+    """Sign a token for `sub` with the newest key in the JWKS file."""
+    keys = read_key_set().keys
+    if not keys:
+        raise typer.BadParameter("No keys yet, run add-key first")
+    key = keys[-1]
+
+    claims = {"sub": sub, "iat": int(time()), "exp": int(time()) + minutes * 60}
+    if os.getenv("JWT_ISSUER"):
+        claims["iss"] = os.environ["JWT_ISSUER"]
+    if os.getenv("JWT_AUDIENCE"):
+        claims["aud"] = os.environ["JWT_AUDIENCE"]
+    typer.echo(jwt.encode({"alg": "ES256", "kid": key.kid}, claims, key))
+
+
+if __name__ == "__main__":
+    cli()
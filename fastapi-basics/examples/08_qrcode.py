@@ -1,18 +1,30 @@
+import asyncio
+import hashlib
 import io
+import multiprocessing
 import os
+import re
+import struct
+import tracemalloc
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from time import localtime, perf_counter, time
+from typing import AsyncIterator, Iterator, Literal
 
 import base45
 import qrcode
 import typer
-from fastapi import Body, FastAPI, HTTPException
+from fastapi import Body, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from joserfc import jwt
 from joserfc.jwk import OctKey
-from pydantic import BaseModel
-
-app = FastAPI(redirect_slashes=True)
-
+from joserfc.jwt import JWTClaimsRegistry
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
 HS256_SECRET_KEY: str = os.getenv("HS256_SECRET_KEY", "supersecretkey")
 SECRET_KEY = OctKey.import_key(HS256_SECRET_KEY)
@@ -36,39 +48,536 @@ def jwt_hs256_sign(user: UserIn):
     return token
 
 
+class VerifiedTokenCache:
+    """
+    LRU cache of tokens whose signature has already been verified, keyed by the
+    SHA-256 digest of the token so the cache does not hold the tokens themselves.
+
+    An entry is kept at most `ttl` seconds and never past the token's own `exp`.
+    Only tokens that passed verification are cached.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, token: str, verified: dict) -> None:
+        expires_at = min(time() + self.ttl, verified["claims"].get("exp", float("inf")))
+        self._entries[self._key(token)] = (expires_at, verified)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+# Every badge token carries `exp`; it is checked on each verification, cached or not
+claims_registry = JWTClaimsRegistry(exp={"essential": True})
+
+token_cache = VerifiedTokenCache(
+    max_size=int(os.getenv("VERIFY_CACHE_SIZE", "100000")),
+    ttl=float(os.getenv("VERIFY_CACHE_TTL", "300")),
+)
+
+
+def verify_token(token: str) -> dict:
+    """
+    Return the `header` and `claims` of a base45-encoded badge token. Raises if the
+    token cannot be decoded, its signature is wrong or its claims are not valid.
+    """
+    verified = token_cache.get(token)
+    if verified is None:
+        decoded_token = jwt.decode(base45.b45decode(token), SECRET_KEY)
+        verified = {"header": decoded_token.header, "claims": decoded_token.claims}
+        claims_registry.validate(verified["claims"])
+        token_cache.put(token, verified)
+    else:
+        claims_registry.validate(verified["claims"])
+
+    return verified
+
+
 def jwt_hs256_verify(token: str):
     try:
-        decoded_base45 = base45.b45decode(token)
-        decoded_token = jwt.decode(decoded_base45, SECRET_KEY)
-        return decoded_token
+        return verify_token(token)
 
     except Exception as e:
         raise HTTPException(status_code=409, detail=f"JWT Verification Failed: {str(e)}")
 
-    return None
 
+# ---- QR Rendering ----
+
+
+QR_BOX_SIZE = 8
+QR_BORDER = 2
+
+# Most of the time to build a matrix goes into trying all 8 mask patterns and scoring each one.
+# Setting QR_MASK_PATTERN (0-7) always uses that mask instead; every mask gives a valid code.
+QR_MASK_PATTERN = int(os.environ["QR_MASK_PATTERN"]) if os.getenv("QR_MASK_PATTERN") else None
 
-@app.post("/", response_class=StreamingResponse)
-def get_signed_qr(user: UserIn):
+QRFormat = Literal["png", "svg"]
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def make_qr(data: str) -> qrcode.QRCode:
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.ERROR_CORRECT_L,
-        box_size=8,
-        border=2,
+        box_size=QR_BOX_SIZE,
+        border=QR_BORDER,
+        mask_pattern=QR_MASK_PATTERN,
     )
 
-    qr.add_data(jwt_hs256_sign(user))
+    qr.add_data(data)
     qr.make(fit=True)
 
+    return qr
+
+
+def render_qr_pillow(qr: qrcode.QRCode) -> bytes:
+    """Render a built QR code to PNG through Pillow, the way `qrcode` does it by default."""
     img = qr.make_image(fill="black", back_color="white")
 
     img_io = io.BytesIO()
     img.save(img_io, "PNG")
-    img_io.seek(0)
 
-    return StreamingResponse(img_io, media_type="image/png")
+    return img_io.getvalue()
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(matrix: list[list[bool]], box_size: int = QR_BOX_SIZE) -> bytes:
+    """
+    Encode a QR module matrix (border included) as a 1-bit grayscale PNG, scaling
+    every module to `box_size` pixels. Gives the same pixels as the Pillow path.
+    """
+    size = len(matrix) * box_size
+    dark, light = "0" * box_size, "1" * box_size
+    padding = "1" * (-size % 8)
+
+    raw = bytearray()
+    for row in matrix:
+        bits = "".join(dark if module else light for module in row) + padding
+        # Filter type 0 (none) followed by the packed pixels, repeated for every pixel row of the module
+        scanline = b"\x00" + int(bits, 2).to_bytes(len(bits) // 8, "big")
+        raw += scanline * box_size
+
+    # Repeats are at most one scanline apart, so a 1 KiB window compresses as well as the default 32 KiB
+    # one while zlib allocates about 40 KiB of state instead of about 300 KiB
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 10, 2)
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            png_chunk(b"IHDR", header),
+            png_chunk(b"IDAT", compressor.compress(raw) + compressor.flush()),
+            png_chunk(b"IEND", b""),
+        )
+    )
+
+
+def encode_svg(matrix: list[list[bool]], box_size: int = QR_BOX_SIZE) -> bytes:
+    """
+    Encode a QR module matrix as SVG: one path drawing each horizontal run of dark
+    modules as a rectangle, in module units scaled up by the `viewBox`.
+    """
+    modules = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        for is_dark, group in groupby(row):
+            length = sum(1 for _ in group)
+            if is_dark:
+                runs.append(f"M{x} {y}h{length}v1h-{length}z")
+            x += length
+
+    size = modules * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+        f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+        f'<path d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+
+def render_qr(data: str, format: QRFormat = "png") -> bytes:
+    """
+    Build the QR code for `data` and encode it as PNG or SVG straight from the
+    module matrix, without Pillow.
+
+    This runs inside the worker processes of `QRRenderer`, so it must stay a
+    module-level function that can be pickled.
+    """
+    matrix = make_qr(data).get_matrix()
+    return encode_svg(matrix) if format == "svg" else encode_png(matrix)
+
+
+def warm_up_worker() -> None:
+    # Render once so imports and qrcode tables are loaded before the first request
+    render_qr("warm-up")
+
+
+class RendererBusy(Exception):
+    """Raised when the render queue is full; the client should retry later."""
+
+
+class QRRenderer:
+    """
+    Renders QR codes in a pool of worker processes, so PNG encoding uses every core
+    instead of holding the GIL of the process that serves requests.
+
+    At most `max_pending` renders may be queued or running at once; past that
+    `render` raises `RendererBusy` right away instead of letting the queue grow.
+    Callers that bound their own concurrency, like the batch endpoint, may skip
+    that check with `admit=False`.
+    """
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.render_seconds = 0.0
+        # Workers are spawned rather than forked, since forking a threaded server process is unsafe
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up_worker,
+        )
+
+    async def start(self) -> None:
+        """Start every worker now, so the first requests do not pay for process startup."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, int) for _ in range(self.workers)))
+
+    @property
+    def busy(self) -> bool:
+        return self.pending >= self.max_pending
+
+    async def render(self, data: str, format: QRFormat = "png", admit: bool = True) -> bytes:
+        if admit and self.busy:
+            self.rejected += 1
+            raise RendererBusy()
+
+        self.pending += 1
+        started = perf_counter()
+        try:
+            image = await asyncio.get_running_loop().run_in_executor(self._pool, render_qr, data, format)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.render_seconds += perf_counter() - started
+        return image
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_render_ms": round(1000 * self.render_seconds / self.completed, 3) if self.completed else None,
+        }
+
+    def close(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
+
+
+# Seconds a client is asked to wait when the render queue is full
+QR_RETRY_AFTER = os.getenv("QR_RETRY_AFTER", "1")
+
+renderer: QRRenderer | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the render pool with warm workers; size it with `QR_WORKERS` and `QR_MAX_PENDING`."""
+    global renderer
+    workers = int(os.getenv("QR_WORKERS", str(os.cpu_count() or 1)))
+    renderer = QRRenderer(workers, int(os.getenv("QR_MAX_PENDING", str(workers * 4))))
+    await renderer.start()
+    try:
+        yield
+    finally:
+        renderer.close()
+        renderer = None
+
+
+app = FastAPI(redirect_slashes=True, lifespan=lifespan)
+
+
+FormatQuery = Query(None, description="Image format; defaults to SVG if `Accept` asks for it, else PNG")
+
+
+def choose_format(format: QRFormat | None, accept: str | None) -> QRFormat:
+    if format is not None:
+        return format
+    return "svg" if accept and MEDIA_TYPES["svg"] in accept else "png"
+
+
+@app.post(
+    "/",
+    response_class=Response,
+    responses={200: {"content": {media_type: {} for media_type in MEDIA_TYPES.values()}}},
+)
+async def get_signed_qr(user: UserIn, format: QRFormat | None = FormatQuery, accept: str | None = Header(None)):
+    format = choose_format(format, accept)
+    try:
+        image = await renderer.render(jwt_hs256_sign(user), format)
+    except RendererBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="QR renderer is busy, try again later",
+            headers={"Retry-After": QR_RETRY_AFTER},
+        )
+
+    return Response(image, media_type=MEDIA_TYPES[format])
+
+
+@app.get("/stats")
+def get_render_stats():
+    return {**renderer.stats(), "verify_cache": token_cache.stats()}
+
+
+# ---- Batch Badges ----
+
+# Largest number of users accepted in one batch request
+QR_BATCH_MAX = int(os.getenv("QR_BATCH_MAX", "10000"))
+
+NDJSON = "application/x-ndjson"
+
+users_adapter = TypeAdapter(list[UserIn])
+
+
+def validation_errors(e: ValidationError, *loc) -> list[dict]:
+    errors = e.errors(include_url=False, include_context=False, include_input=False)
+    return [{**error, "loc": [*loc, *error["loc"]]} for error in errors]
+
+
+def parse_batch(body: bytes, content_type: str) -> list[UserIn]:
+    """Parse a JSON array or, for `application/x-ndjson`, one JSON object per line."""
+    if not content_type.startswith(NDJSON):
+        try:
+            return users_adapter.validate_json(body)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=validation_errors(e, "body"))
+
+    users, errors = [], []
+    for number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            users.append(UserIn.model_validate_json(line))
+        except ValidationError as e:
+            errors += validation_errors(e, "line", number)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    return users
+
+
+class ZipSink:
+    """Write-only file object that collects what `zipfile` writes, so it can be streamed out chunk by chunk."""
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def badge_filename(index: int, user: UserIn, format: QRFormat) -> str:
+    return f"{index:05d}-{re.sub(r'[^A-Za-z0-9_-]+', '_', user.name)[:40]}.{format}"
+
+
+async def render_badges(users: list[UserIn], format: QRFormat) -> AsyncIterator[tuple[int, bytes]]:
+    """
+    Sign and render `users`, yielding `(index, image)` as each image finishes.
+
+    Only `2 * workers` renders are in flight at a time, and each JWT is signed just
+    before its render is submitted, so the first image is ready after the same
+    short delay whatever the batch size.
+    """
+    window = 2 * renderer.workers
+    queued: Iterator[tuple[int, UserIn]] = iter(enumerate(users))
+    in_flight: dict[asyncio.Task, int] = {}
+
+    def submit() -> None:
+        for index, user in queued:
+            in_flight[asyncio.ensure_future(renderer.render(jwt_hs256_sign(user), format, admit=False))] = index
+            if len(in_flight) >= window:
+                return
+
+    try:
+        submit()
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield in_flight.pop(task), task.result()
+            submit()
+    finally:
+        # The client went away or a render failed: stop the renders still in flight
+        for task in in_flight:
+            task.cancel()
+
+
+async def stream_badge_zip(users: list[UserIn], format: QRFormat) -> AsyncIterator[bytes]:
+    """Stream a ZIP archive with one image per user, writing each entry as soon as its image is ready."""
+    sink = ZipSink()
+    date_time = localtime()[:6]
+    # PNG is already compressed, so only SVG entries are worth deflating
+    compression = zipfile.ZIP_DEFLATED if format == "svg" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, "w", compression=compression) as archive:
+        async for index, image in render_badges(users, format):
+            entry = zipfile.ZipInfo(badge_filename(index, users[index], format), date_time)
+            archive.writestr(entry, image, compress_type=compression)
+            yield sink.take()
+    yield sink.take()
+
+
+@app.post(
+    "/batch",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/zip": {}}}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": UserIn.model_json_schema()}},
+                NDJSON: {"schema": UserIn.model_json_schema()},
+            },
+        }
+    },
+)
+async def get_signed_qr_batch(request: Request, format: QRFormat = Query("png", description="Image format")):
+    """
+    Sign and render a badge QR code for every user in a JSON array or NDJSON body,
+    streamed back as a ZIP archive of images named `{index}-{name}.{format}`.
+
+    Entries appear in the order the images finish rather than input order, and are
+    sent as soon as they are written, so the archive is never held in memory.
+    """
+    users = parse_batch(await request.body(), request.headers.get("content-type", ""))
+    if len(users) > QR_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {QR_BATCH_MAX} users per batch")
+    if renderer.busy:
+        raise HTTPException(
+            status_code=503,
+            detail="QR renderer is busy, try again later",
+            headers={"Retry-After": QR_RETRY_AFTER},
+        )
+
+    return StreamingResponse(
+        stream_badge_zip(users, format),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="badges.zip"'},
+    )
+
+
+# ---- Verification ----
+# Verification is a few microseconds on a cache hit, so these routes run on the event loop
+# rather than paying for a hop to the thread pool.
+
+# Largest number of tokens accepted in one batch verification
+VERIFY_BATCH_MAX = int(os.getenv("VERIFY_BATCH_MAX", "10000"))
 
 
 @app.post("/verify")
-def verify_jwt(body: str = Body(..., media_type="text/plain")):
+async def verify_jwt(body: str = Body(..., media_type="text/plain")):
     return {"data": jwt_hs256_verify(body)}
+
+
+@app.post("/verify/batch")
+async def verify_jwt_batch(tokens: list[str] = Body(..., max_length=VERIFY_BATCH_MAX)):
+    """
+    Verify many badge tokens at once. Returns one result per token, in order: either
+    `{"valid": true, "data": ...}` or `{"valid": false, "error": ...}`.
+    """
+    results = []
+    for token in tokens:
+        try:
+            results.append({"valid": True, "data": verify_token(token)})
+        except Exception as e:
+            results.append({"valid": False, "error": f"JWT Verification Failed: {str(e)}"})
+
+    return {"results": results}
+
+
+# ---- Encoder Benchmark ----
+
+cli = typer.Typer()
+
+
+def measure(func, count: int) -> tuple[float, float]:
+    """Return the mean milliseconds per call over `count` calls, and the peak KiB allocated by one call."""
+    func()
+    started = perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = (perf_counter() - started) / count
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 1024
+
+
+@cli.command()
+def bench(count: int = typer.Option(200, help="Calls per measurement")):
+    """
+    Compare the Pillow PNG path with the matrix-based PNG and SVG encoders on one
+    badge token: latency and peak memory per call, and output size. Building the
+    QR matrix is shared by all of them and measured on its own.
+    """
+    data = jwt_hs256_sign(UserIn(name="Benchmark User"))
+    qr = make_qr(data)
+    matrix = qr.get_matrix()
+
+    ms, kib = measure(lambda: make_qr(data), count)
+    typer.echo(f"QR matrix ({len(matrix)}x{len(matrix)} modules): {ms:.3f} ms, {kib:.1f} KiB peak\n")
+
+    encoders = {
+        "pillow": lambda: render_qr_pillow(qr),
+        "png": lambda: encode_png(matrix),
+        "svg": lambda: encode_svg(matrix),
+    }
+    typer.echo(f"{'encoder':<8} {'ms':>8} {'peak KiB':>10} {'bytes':>8}")
+    for name, encode in encoders.items():
+        ms, kib = measure(encode, count)
+        typer.echo(f"{name:<8} {ms:>8.3f} {kib:>10.1f} {len(encode()):>8}")
+
+
+if __name__ == "__main__":
+    cli()
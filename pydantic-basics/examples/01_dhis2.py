@@ -1,7 +1,10 @@
-from typing import List
+import os
+import time
+from array import array
+from typing import Annotated, Iterable, Iterator, List, NamedTuple, Optional
 
 import httpx
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, WrapValidator
 
 
 class IdSchemaIn(BaseModel):
@@ -13,27 +16,246 @@ class DataElementIn(IdSchemaIn):
     groups: List[IdSchemaIn] = Field(alias="dataElementGroups")
 
 
+# Point these at another server, e.g. the stand-in in fastapi-basics-part2, with DHIS2_URL etc.
+DHIS2_URL = os.getenv("DHIS2_URL", "https://play.im.dhis2.org/dev").rstrip("/")
+DATA_ELEMENTS_URL = f"{DHIS2_URL}/api/dataElements"
+AUTH = (os.getenv("DHIS2_USERNAME", "admin"), os.getenv("DHIS2_PASSWORD", "district"))
+PARAMS = {"paging": False, "fields": "id,name,dataElementGroups[id]"}
+PAGE_SIZE = 1000
+# Worth another try when fetching page after page: rate limiting and brief outages
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+# ---- Lenient Validation ----
+
+
+class RecordError(NamedTuple):
+    """Why the record at `index` (counting from 0, valid ones included) was rejected."""
+
+    index: int
+    id: Optional[str]
+    errors: list
+
+
+def _reject(value, handler, info):
+    """Validates one record; an invalid one becomes None and its errors are noted in the context."""
+    try:
+        return handler(value)
+    except ValidationError as e:
+        uid = value.get("id") if isinstance(value, dict) else None
+        info.context.append((uid if isinstance(uid, str) else None, e.errors(include_url=False)))
+        return None
+
+
+class Pager(BaseModel):
+    page_count: int = Field(alias="pageCount")
+
+
 class MetadataResponse(BaseModel):
-    data_elements: List[DataElementIn] = Field(alias="dataElements")
+    pager: Optional[Pager] = None
+    # One bad data element must not fail the whole response, see `parse_data_elements`
+    data_elements: List[Annotated[DataElementIn, WrapValidator(_reject)]] = Field(alias="dataElements")
+
+
+def parse_data_elements(content: bytes, errors: list, offset: int = 0) -> MetadataResponse:
+    """
+    Validates a `dataElements` response straight from its bytes, in one pass.
+
+    Invalid data elements are left out of the result and a `RecordError` for each,
+    numbered from `offset`, is added to `errors`.
+    """
+    problems = []
+    parsed = MetadataResponse.model_validate_json(content, context=problems)
+    rejected = (index for index, element in enumerate(parsed.data_elements) if element is None)
+    errors.extend(RecordError(offset + index, *problem) for index, problem in zip(rejected, problems))
+    parsed.data_elements = [element for element in parsed.data_elements if element is not None]
+    return parsed
+
+
+def stream_data_elements(errors: Optional[list] = None) -> Iterator[DataElementIn]:
+    """
+    Yields data elements a page at a time, so memory use stays flat no matter how
+    many data elements the server has. Invalid ones are skipped and noted in `errors`.
+    """
+    errors = [] if errors is None else errors
+    params = {**PARAMS, "paging": True, "pageSize": PAGE_SIZE}
+    with httpx.Client(auth=AUTH) as client:
+        page, page_count = 1, 1
+        while page <= page_count:
+            for attempt in range(4):
+                response = client.get(DATA_ELEMENTS_URL, params={**params, "page": page})
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                time.sleep(0.5 * 2**attempt)
+            response.raise_for_status()
+            parsed = parse_data_elements(response.content, errors, (page - 1) * PAGE_SIZE)
+            yield from parsed.data_elements
+            page_count = parsed.pager.page_count if parsed.pager else page
+            page += 1
+
+
+# ---- Metadata Graph ----
+
+
+class UidIndex:
+    """Interns DHIS2 UIDs: each distinct UID gets the next integer, starting from 0."""
+
+    def __init__(self) -> None:
+        self._numbers: dict[str, int] = {}
+        self.uids: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    def add(self, uid: str) -> int:
+        number = self._numbers.get(uid)
+        if number is None:
+            number = self._numbers[uid] = len(self.uids)
+            self.uids.append(uid)
+        return number
+
+    def get(self, uid: str) -> Optional[int]:
+        return self._numbers.get(uid)
+
+
+def compressed_rows(sources: array, targets: array, size: int) -> tuple[array, array]:
+    """
+    Turns the edge list `sources[i] -> targets[i]` into compressed sparse rows:
+    the targets of node `n` are `columns[offsets[n] : offsets[n + 1]]`.
+    """
+    offsets = array("i", [0]) * (size + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    for node in range(size):
+        offsets[node + 1] += offsets[node]
+
+    columns = array("i", [0]) * len(sources)
+    next_slot = offsets[:-1]
+    for source, target in zip(sources, targets):
+        columns[next_slot[source]] = target
+        next_slot[source] += 1
+    return offsets, columns
+
+
+class MetadataGraph:
+    """
+    Which data elements are in which groups, as plain integer arrays.
+
+    UIDs are interned to dense integers once, and membership is stored both ways
+    as compressed sparse rows. That costs a few bytes per edge instead of an
+    `IdSchemaIn` model per group reference, and "groups of element" and "elements
+    in group" are each answered in time proportional to the answer.
+    """
+
+    def __init__(self, elements: UidIndex, names: list[str], groups: UidIndex, edges: tuple[array, array]) -> None:
+        self.elements = elements
+        self.names = names
+        self.groups = groups
+        self.element_offsets, self.element_groups = compressed_rows(edges[0], edges[1], len(elements))
+        self.group_offsets, self.group_elements = compressed_rows(edges[1], edges[0], len(groups))
+
+    @classmethod
+    def from_elements(cls, elements: Iterable[DataElementIn]) -> "MetadataGraph":
+        """Build the graph from data elements as they come, e.g. from `stream_data_elements()`."""
+        element_index, group_index = UidIndex(), UidIndex()
+        names: list[str] = []
+        edge_elements, edge_groups = array("i"), array("i")
+        for element in elements:
+            number = element_index.add(element.id)
+            if number == len(names):
+                names.append(element.name)
+            for group in element.groups:
+                edge_elements.append(number)
+                edge_groups.append(group_index.add(group.id))
+        return cls(element_index, names, group_index, (edge_elements, edge_groups))
+
+    def groups_of(self, element_uid: str) -> list[str]:
+        """UIDs of the groups `element_uid` belongs to. Raises KeyError for an unknown element."""
+        number = self.elements.get(element_uid)
+        if number is None:
+            raise KeyError(element_uid)
+        start, end = self.element_offsets[number], self.element_offsets[number + 1]
+        return [self.groups.uids[group] for group in self.element_groups[start:end]]
+
+    def elements_in(self, group_uid: str) -> list[str]:
+        """UIDs of the data elements in `group_uid`. Raises KeyError for an unknown group."""
+        number = self.groups.get(group_uid)
+        if number is None:
+            raise KeyError(group_uid)
+        start, end = self.group_offsets[number], self.group_offsets[number + 1]
+        return [self.elements.uids[element] for element in self.group_elements[start:end]]
+
+    def name(self, element_uid: str) -> str:
+        number = self.elements.get(element_uid)
+        if number is None:
+            raise KeyError(element_uid)
+        return self.names[number]
+
+    def __repr__(self) -> str:
+        return (
+            f"MetadataGraph({len(self.elements)} data elements, {len(self.groups)} groups, "
+            f"{len(self.element_groups)} memberships)"
+        )
+
+
+def env_flag(name: str) -> bool:
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+
+def print_errors(errors: list, limit: int = 5) -> None:
+    for error in errors[:limit]:
+        details = "; ".join(f"{'.'.join(map(str, e['loc'])) or 'record'}: {e['msg']}" for e in error.errors)
+        print(f"  #{error.index} {error.id or '(no id)'}: {details}")
+    if len(errors) > limit:
+        print(f"  ... and {len(errors) - limit} more")
 
 
 def main() -> None:
     """
     Fetches metadata from DHIS2 API and parses the response into structured models.
+    Set DHIS2_STREAM=1 to fetch and parse the data elements a page at a time instead, or
+    DHIS2_GRAPH=1 to load them into a `MetadataGraph`.
     """
+    if env_flag("DHIS2_GRAPH"):
+        graph = MetadataGraph.from_elements(stream_data_elements())
+        print(graph)
+        if graph.groups:
+            group = graph.groups.uids[0]
+            members = graph.elements_in(group)
+            print(f"Group {group} has {len(members)} data elements, e.g. {members[:3]}")
+            print(f"{members[0]} ({graph.name(members[0])}) is in groups {graph.groups_of(members[0])}")
+        return
+
+    if env_flag("DHIS2_STREAM"):
+        errors = []
+        elements = stream_data_elements(errors)
+        first = next(elements)
+        print(first)
+        print(first.model_dump_json(indent=2))
+        # The rest are validated and dropped a page at a time
+        print("Data elements:", 1 + sum(1 for _ in elements))
+        print("Invalid:", len(errors))
+        print_errors(errors)
+        return
+
     # Make a GET request to the DHIS2 demo server with basic auth
-    response = httpx.get(
-        "https://play.im.dhis2.org/dev/api/dataElements",
-        auth=("admin", "district"),
-        params={"paging": False, "fields": "id,name,dataElementGroups[id]"},
-    )
+    response = httpx.get(DATA_ELEMENTS_URL, auth=AUTH, params=PARAMS)
+    response.raise_for_status()
 
-    # Parse the response using the alias-aware model
-    parsed = MetadataResponse.model_validate(response.json())
+    # Validate the data elements straight from the response bytes with the alias-aware model,
+    # keeping the valid ones when some are not
+    errors = []
+    started = time.perf_counter()
+    data_elements = parse_data_elements(response.content, errors).data_elements
+    elapsed = time.perf_counter() - started
 
     # Print the first data element (as object and JSON)
-    print(parsed.data_elements[0])  # __repr__ output of the Pydantic model
-    print(parsed.data_elements[0].model_dump_json(indent=2))  # Pretty JSON output
+    print(data_elements[0])  # __repr__ output of the Pydantic model
+    print(data_elements[0].model_dump_json(indent=2))  # Pretty JSON output
+
+    total = len(data_elements) + len(errors)
+    print(f"Validated {total} data elements in {elapsed:.2f}s ({total / elapsed:,.0f}/s), {len(errors)} invalid")
+    print_errors(errors)
 
 
 # Entry point guard